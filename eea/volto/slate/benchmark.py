@@ -0,0 +1,287 @@
+""" Benchmark the html2slate parser backends on a corpus of HTML files
+
+Usage::
+
+    python -m eea.volto.slate.benchmark [-n REPEAT] FILE_OR_DIR [...]
+
+It prints the throughput of each backend and the value to use for the
+``slate_html_parser`` environment variable, see config.HTML_PARSER.
+
+With ``--links N`` it instead times the link transform of the slate block
+serializer (block.SlateBlockTransformer) over a value with N internal links:
+the walk that collects the links, with and without the handler dispatch
+table, and the complete transform that also rewrites them to URLs. The
+catalog query for the UIDs and the request memo need a Plone site and aren't
+timed, the URLs are looked up in a prepared mapping instead.
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+from .html2slate import HTML2Slate
+from .parsers import PARSERS
+from .utils import (RESOLVEUID_RE, get_node_handlers, internal_links,
+                    iterate_children, iterate_nodes, resolved_url)
+
+
+def benchmark_parsers(texts, parsers=None, repeat=3):
+    """Returns a {parser name: seconds} mapping with the best time, out of
+    ``repeat`` runs, to convert all the texts with each parser backend
+
+    :param texts: a list of HTML strings
+    :param parsers: names of the backends, by default all of them
+    :param repeat:
+    """
+    timings = {}
+    for name in parsers or sorted(PARSERS):
+        converter = HTML2Slate(parser=name)
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            for text in texts:
+                converter.to_slate(text)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    return timings
+
+
+def fastest_parser(texts, parsers=None, repeat=3):
+    """Returns the name of the fastest parser backend for the texts
+
+    :param texts: a list of HTML strings
+    :param parsers: names of the backends, by default all of them
+    :param repeat:
+    """
+    timings = benchmark_parsers(texts, parsers, repeat)
+    return min(sorted(timings), key=timings.get)
+
+
+def differences(texts, parsers=None):
+    """Returns the number of texts that don't have the same slate value with
+    all the parser backends, as HTML parsers fix broken markup differently
+
+    :param texts: a list of HTML strings
+    :param parsers: names of the backends, by default all of them
+    """
+    converters = [HTML2Slate(parser=name) for name in parsers or sorted(PARSERS)]
+    count = 0
+    for text in texts:
+        values = [converter.to_slate(text) for converter in converters]
+        if any(value != values[0] for value in values[1:]):
+            count += 1
+    return count
+
+
+def link_heavy_value(links, words=30):
+    """Returns a slate value of paragraphs with text, formatting and one
+    internal link each
+
+    :param links: the number of links
+    :param words: the number of words of text around each link
+    """
+    text = " ".join(["word"] * (words // 2))
+    value = []
+    for i in range(links):
+        link = {
+            "type": "a",
+            "children": [{"text": "link {}".format(i)}],
+            "data": {
+                "link": {
+                    "internal": {
+                        "internal_link": [
+                            {"@id": "../resolveuid/{:032x}".format(i)}
+                        ]
+                    }
+                }
+            },
+        }
+        value.append(
+            {
+                "type": "p",
+                "children": [
+                    {"text": text},
+                    {"type": "strong", "children": [{"text": text}, link]},
+                    {"text": text, "italic": True},
+                ],
+            }
+        )
+    return value
+
+
+class LinkCollector(object):
+    """Collects the internal links of slate values, like the slate block
+    transformers do before they resolve them with the catalog"""
+
+    def __init__(self):
+        self.links = []
+
+    def handle_a(self, child):
+        """handle_a.
+
+        :param child:
+        """
+        self.links.extend(internal_links(child))
+
+
+def walk_by_lookup(collector, value):
+    """Walk a value with a handler lookup on each node, the way the slate
+    block transformers used to
+
+    :param collector:
+    :param value:
+    """
+    for child in iterate_children(value):
+        node_type = child.get("type")
+        if node_type:
+            handler = getattr(collector, "handle_{}".format(node_type), None)
+            if handler:
+                handler(child)
+
+
+def walk_by_type(collector, value):
+    """Walk a value with the dispatch table of the collector, the way the
+    slate block transformers do
+
+    :param collector:
+    :param value:
+    """
+    handlers = get_node_handlers(type(collector))
+    for child in iterate_nodes(value, handlers):
+        handlers[child["type"]](collector, child)
+
+
+def link_urls(values):
+    """Returns a {uid: url} mapping for the resolveuid links of the values,
+    standing for the catalog query of the slate block serializer
+
+    :param values: a list of slate values, see link_heavy_value
+    """
+    urls = {}
+    for value in values:
+        collector = LinkCollector()
+        walk_by_type(collector, value)
+        for link in collector.links:
+            match = RESOLVEUID_RE.match(link.get("@id") or "")
+            if match is not None:
+                uid = match.group(1)
+                urls[uid] = "http://nohost/plone/page-{}".format(uid[-6:])
+    return urls
+
+
+def transform_links(value, urls):
+    """Collect the internal links of a value and rewrite them to URLs, the
+    way the slate block serializer does once the UIDs are looked up
+
+    :param value: a slate value, changed in place
+    :param urls: a {uid: url} mapping, see link_urls
+    """
+    collector = LinkCollector()
+    walk_by_type(collector, value)
+    for link in collector.links:
+        link["@id"] = resolved_url(link.get("@id"), urls)
+
+
+def benchmark_link_walk(values, repeat=3):
+    """Returns a {name: seconds} mapping with the best time, out of
+    ``repeat`` runs, to collect the internal links of all the values with
+    each walk, and to transform them (see transform_links)
+
+    :param values: a list of slate values, see link_heavy_value
+    :param repeat:
+    """
+    timings = {}
+    for name, walk in (("lookup", walk_by_lookup), ("type", walk_by_type)):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            for value in values:
+                walk(LinkCollector(), value)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+
+    urls = link_urls(values)
+    best = None
+    for _ in range(repeat):
+        # the transform rewrites the links, each run gets fresh copies
+        copies = copy.deepcopy(values)
+        start = time.time()
+        for value in copies:
+            transform_links(value, urls)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    timings["transform"] = best
+    return timings
+
+
+def read_corpus(paths):
+    """Returns the content of the files, searching directories for .html files
+
+    :param paths:
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _dirnames, filenames in os.walk(path):
+                files.extend(
+                    os.path.join(dirpath, filename)
+                    for filename in sorted(filenames)
+                    if filename.endswith((".html", ".htm"))
+                )
+        else:
+            files.append(path)
+
+    texts = []
+    for path in files:
+        with open(path) as f:
+            texts.append(f.read())
+    return texts
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", help="HTML files or directories")
+    parser.add_argument("-n", "--repeat", type=int, default=3)
+    parser.add_argument(
+        "--links",
+        type=int,
+        help="time the link transform of a value with LINKS links",
+    )
+    args = parser.parse_args(argv)
+
+    out = sys.stdout
+    if args.links:
+        timings = benchmark_link_walk([link_heavy_value(args.links)], args.repeat)
+        for name in sorted(timings, key=timings.get):
+            elapsed = timings[name] or 1e-9
+            out.write(
+                "{:<12} {:10.3f}ms {:12.0f} links/s\n".format(
+                    name, elapsed * 1000, args.links / elapsed
+                )
+            )
+        return
+    if not args.paths:
+        parser.error("no HTML files or directories given")
+
+    texts = read_corpus(args.paths)
+    size = sum(len(text) for text in texts) / (1024.0 * 1024)
+    timings = benchmark_parsers(texts, repeat=args.repeat)
+
+    out.write("{} documents, {:.2f} MB\n".format(len(texts), size))
+    for name in sorted(timings, key=timings.get):
+        elapsed = timings[name] or 1e-9
+        out.write(
+            "{:<12} {:8.3f}s {:8.2f} MB/s {:10.1f} docs/s\n".format(
+                name, elapsed, size / elapsed, len(texts) / elapsed
+            )
+        )
+    out.write("Documents with different results: {}\n".format(differences(texts)))
+    out.write("slate_html_parser={}\n".format(min(sorted(timings), key=timings.get)))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,18 +3,59 @@
 """ block module """
 import os
 
+from AccessControl import Unauthorized
+from zExceptions import NotFound
+from zope.annotation.interfaces import IAnnotations
 from zope.interface import implementer
-from zope.component import adapter
+from zope.component import adapter, queryMultiAdapter
+from zope.globalrequest import getRequest
 from zope.publisher.interfaces.browser import IBrowserRequest
 from plone import api
 from plone.restapi.behaviors import IBlocks
 from plone.restapi.deserializer.blocks import path2uid
 from plone.restapi.interfaces import (IBlockFieldDeserializationTransformer,
                                       IBlockFieldSerializationTransformer)
-from plone.restapi.serializer.blocks import uid_to_url
 from Products.CMFPlone.interfaces import IPloneSiteRoot
 
-from .utils import iterate_children
+try:
+    from plone.restapi.interfaces import IObjectPrimaryFieldTarget
+except ImportError:  # plone.restapi < 8
+    IObjectPrimaryFieldTarget = None
+
+from .cache import LRUCache
+from .config import UID_PATH_CACHE_SIZE
+from .utils import (RESOLVEUID_RE, get_node_handlers, internal_links,
+                    iterate_nodes, node_paths, nodes_at, resolved_url)
+
+# content paths by catalog counter and UID, see uids_to_paths
+UID_PATHS = LRUCache(UID_PATH_CACHE_SIZE)
+
+# request annotation of the link transforms memo, see request_memo
+MEMO_KEY = "eea.volto.slate.links"
+
+# the types of the link nodes, and the block key of their paths in the block
+# value, see index_links
+LINK_TYPES = frozenset(["a"])
+LINK_PATHS = "linkPaths"
+
+
+def index_links(block, field="value"):
+    """Store the paths of the link nodes of the block value in the block, so
+    the serializer goes straight to them, or skips a block without links.
+    It has to be called each time the value changes: the deserializer does
+    it on save, code that writes the ``blocks`` of content directly has to
+    call it for each slate block it changes. The serializer only checks that
+    the paths still lead to link nodes, links added elsewhere are missed.
+
+    Don't store the paths when the transforms are disabled (see the
+    ``disabled`` attribute of the transformers): nothing would then remove
+    them from the serialized blocks or rebuild them on save.
+
+    :param block:
+    :param field: the field of the slate value
+    """
+    block[LINK_PATHS] = node_paths(block.get(field) or [], LINK_TYPES)
+    return block
 
 
 def transform_links(context, value, transformer):
@@ -22,38 +63,183 @@ def transform_links(context, value, transformer):
        http://localhost:55001/plone/link-target
        ->
        ../resolveuid/023c61b44e194652804d05a15dc126f4"""
-    data = value.get("data", {})
-    if data.get("link", {}).get("internal", {}).get("internal_link"):
-        internal_link = data["link"]["internal"]["internal_link"]
-        for link in internal_link:
-            link["@id"] = transformer(context, link["@id"])
+    for link in internal_links(value):
+        link["@id"] = transformer(context, link["@id"])
+
+
+def uids_to_paths(uids):
+    """Returns a {uid: path} mapping of the physical paths of the content with
+    the given UIDs. Unknown UIDs are left out.
+
+    The paths are cached in this process, the ones that aren't are found with
+    a single catalog query. The cache keys include the catalog counter, which
+    changes with any (un)indexing in all the ZEO clients, so a moved object
+    is never found at its old path.
+
+    :param uids:
+    """
+    if not uids:
+        return {}
+    catalog = api.portal.get_tool("portal_catalog")
+    counter = catalog.getCounter()
+
+    paths = {}
+    missing = []
+    for uid in uids:
+        path = UID_PATHS.get("{}:{}".format(counter, uid))
+        if path is None:
+            missing.append(uid)
+        else:
+            paths[uid] = path
+
+    if missing:
+        found = {}
+        for brain in catalog.unrestrictedSearchResults(UID=missing):
+            found.setdefault(brain.UID, []).append(brain.getPath())
+        for uid, uid_paths in found.items():
+            # like uuidToCatalogBrain, a duplicated UID isn't resolved
+            if len(uid_paths) == 1:
+                paths[uid] = uid_paths[0]
+                UID_PATHS.set("{}:{}".format(counter, uid), uid_paths[0])
+    return paths
+
+
+def primary_field_target(path, request):
+    """Returns the URL of the primary field target of the content at a
+    physical path, like the download URL of a file, or None. plone.restapi's
+    uid_to_url links to it instead of the content when the link has no
+    suffix, see IObjectPrimaryFieldTarget (plone.restapi 8).
+
+    :param path:
+    :param request:
+    """
+    if IObjectPrimaryFieldTarget is None:
+        return None
+    try:
+        obj = api.portal.get().restrictedTraverse(path)
+    except (AttributeError, KeyError, NotFound, Unauthorized):
+        return None
+    target = queryMultiAdapter((obj, request), IObjectPrimaryFieldTarget)
+    if target is None:
+        return None
+    return target() or None
+
+
+def request_memo(request):
+    """Returns the memo of the link transforms of a request, shared by the
+    transformers of all the blocks serialized in the request: the portal,
+    its URL and physical path, and the serialized ``@id`` of each link.
+
+    :param request:
+    """
+    annotations = IAnnotations(request)
+    memo = annotations.get(MEMO_KEY)
+    if memo is None:
+        portal = api.portal.get()
+        memo = annotations[MEMO_KEY] = {
+            "portal": portal,
+            "portal_url": portal.absolute_url(),
+            "portal_path": "/".join(portal.getPhysicalPath()),
+            "links": {},
+        }
+    return memo
+
+
+def invalidate_uid_paths(obj, event):
+    """Clear the cached content paths of this process, and the memo of the
+    current request, when content is added, moved, renamed or removed.
+    Other ZEO clients rely on the catalog counter.
+
+    :param obj:
+    :param event: an IObjectMovedEvent, including IObjectAddedEvent and
+        IObjectRemovedEvent
+    """
+    UID_PATHS.clear()
+    request = getRequest()
+    if request is not None:
+        IAnnotations(request).pop(MEMO_KEY, None)
+
+
+def paths_to_uids(paths):
+    """Returns a {path: uid} mapping of the content at the given physical
+    paths, found with a single catalog query. Paths of content that isn't
+    cataloged are left out.
+
+    :param paths:
+    """
+    if not paths:
+        return {}
+    catalog = api.portal.get_tool("portal_catalog")
+    brains = catalog.unrestrictedSearchResults(
+        path={"query": list(paths), "depth": 0}
+    )
+    return dict((brain.getPath(), brain.UID) for brain in brains)
+
+
+def physical_path(link, portal_url, portal_path):
+    """Returns the physical path of an internal link, the way plone.restapi's
+    path2uid finds the link target
+
+    :param link: an absolute URL or a path
+    :param portal_url:
+    :param portal_path:
+    """
+    path = link
+    if path.startswith(portal_url):
+        path = path[len(portal_url) + 1 :]
+    if not path.startswith(portal_path):
+        path = "{}/{}".format(portal_path, path.lstrip("/"))
+    return path
 
 
 class SlateBlockTransformer(object):
-    """SlateBlockTransformer."""
+    """SlateBlockTransformer.
+
+    The value of the block is walked once, the ``handle_<type>`` methods are
+    called with the nodes of their type, see utils.get_node_handlers.
+    """
 
     field = "value"
 
     def __init__(self, context, request):
         self.context = context
         self.request = request
+        self.links = []
 
     def __call__(self, block):
-        # if isinstance(block["value"], six.string_types):
-        #     import pdb
-        #
-        #     pdb.set_trace()
-
-        value = getattr(block, self.field, [])
-        for child in iterate_children(value or []):
-            node_type = child.get("type")
-            if node_type:
-                handler = getattr(self, "handle_{}".format(node_type), None)
-                if handler:
-                    handler(child)
+        # node type -> handle_* function, see get_node_handlers
+        handlers = get_node_handlers(type(self))
+        for child in self.handled_nodes(block, handlers):
+            handlers[child["type"]](self, child)
+
+        if self.links:
+            links, self.links = self.links, []
+            self.resolve_links(links)
 
         return block
 
+    def handled_nodes(self, block, handlers):
+        """Returns the nodes of the block value that have a handler
+
+        :param block:
+        :param handlers: the node handlers, see get_node_handlers
+        """
+        return iterate_nodes(block.get(self.field) or [], handlers)
+
+    def handle_a(self, child):
+        """Collect the internal links of a link node, they're rewritten
+        together by resolve_links once the whole value is walked
+
+        :param child:
+        """
+        self.links.extend(internal_links(child))
+
+    def resolve_links(self, links):
+        """Rewrite the ``@id`` of the internal links of the block
+
+        :param links:
+        """
+
 
 class SlateBlockSerializerBase(SlateBlockTransformer):
     """SlateBlockSerializerBase."""
@@ -62,21 +248,57 @@ class SlateBlockSerializerBase(SlateBlockTransformer):
     block_type = "slate"
     disabled = os.environ.get("disable_transform_resolveuid", False)
 
-    def _uid_to_url(self, context, path):
-        """_uid_to_url.
+    def handled_nodes(self, block, handlers):
+        """Returns the nodes of the block value that have a handler. The link
+        nodes are found with the paths stored by index_links, if they still
+        lead to links, the whole value is walked otherwise.
 
-        :param context:
-        :param path:
+        :param block:
+        :param handlers: the node handlers, see get_node_handlers
         """
-        portal = api.portal.get()
-        return uid_to_url(path).replace(portal.absolute_url(), "")
+        paths = block.pop(LINK_PATHS, None)
+        if paths is not None and LINK_TYPES.issuperset(handlers):
+            nodes = nodes_at(block.get(self.field) or [], paths, LINK_TYPES)
+            if nodes is not None:
+                return nodes
+        return iterate_nodes(block.get(self.field) or [], handlers)
 
-    def handle_a(self, child):
-        """handle_a.
+    def resolve_links(self, links):
+        """Convert the resolveuid links to paths, with a single catalog query
+        for all the links of the block. Links already converted in this
+        request are taken from the request memo.
 
-        :param child:
+        :param links:
         """
-        transform_links(self.context, child, transformer=self._uid_to_url)
+        memo = request_memo(self.request)
+        resolved = memo["links"]
+
+        uids = set()
+        plain_uids = set()  # the UIDs of links without suffix
+        for link in links:
+            if link["@id"] not in resolved:
+                match = RESOLVEUID_RE.match(link["@id"] or "")
+                if match is not None:
+                    uids.add(match.group(1))
+                    if not match.group(2):
+                        plain_uids.add(match.group(1))
+
+        paths = uids_to_paths(uids)
+        urls = {}
+        targets = {}
+        for uid, path in paths.items():
+            urls[uid] = self.request.physicalPathToURL(path)
+            if uid in plain_uids:
+                target = primary_field_target(path, self.request)
+                if target:
+                    targets[uid] = target
+
+        for link in links:
+            path = link["@id"]
+            if path not in resolved:
+                url = resolved_url(path, urls, targets)
+                resolved[path] = url.replace(memo["portal_url"], "")
+            link["@id"] = resolved[path]
 
 
 @implementer(IBlockFieldSerializationTransformer)
@@ -98,12 +320,41 @@ class SlateBlockDeserializerBase(SlateBlockTransformer):
     block_type = "slate"
     disabled = os.environ.get("disable_transform_resolveuid", False)
 
-    def handle_a(self, child):
-        """handle_a.
+    def __call__(self, block):
+        block = super(SlateBlockDeserializerBase, self).__call__(block)
+        return index_links(block, self.field)
 
-        :param child:
+    def resolve_links(self, links):
+        """Convert the links to resolveuid ones, with a single catalog query
+        for all the distinct paths of the block. Links to content that isn't
+        cataloged, or with a path suffix like @@images, are converted by
+        path2uid.
+
+        :param links:
         """
-        transform_links(self.context, child, transformer=path2uid)
+        memo = request_memo(self.request)
+        portal_url = memo["portal_url"]
+        portal_path = memo["portal_path"]
+        relative_up = len(self.context.absolute_url().split("/")) - len(
+            portal_url.split("/")
+        )
+
+        paths = {}
+        for link in links:
+            if link["@id"]:
+                paths[link["@id"]] = physical_path(link["@id"], portal_url, portal_path)
+        uids = paths_to_uids(set(paths.values()) - set([portal_path]))
+
+        hrefs = {}
+        for href, path in paths.items():
+            uid = uids.get(path)
+            if uid is None:
+                hrefs[href] = path2uid(self.context, href)
+            else:
+                hrefs[href] = relative_up * "../" + "resolveuid/" + uid
+
+        for link in links:
+            link["@id"] = hrefs.get(link["@id"], "")
 
 
 @adapter(IBlocks, IBrowserRequest)
@@ -0,0 +1,207 @@
+""" cache module """
+import hashlib
+import json
+import logging
+import marshal
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from threading import Lock, local
+
+logger = logging.getLogger("eea.volto.slate")
+
+CANONICAL_ENCODER = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+
+def digest(*parts):
+    """Returns a hex digest of the parts, strings or bytes-like objects. A
+    bytes-like part has the digest of its UTF-8 decoded string.
+
+    :param parts:
+    """
+    # each part is followed by a NUL, hashed in a single update
+    if all(isinstance(part, str) for part in parts):
+        data = u"\0".join(parts) + u"\0"
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(part.encode("utf-8") if isinstance(part, str) else part)
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def structural_hash(value):
+    """Returns a hex digest of a JSON compatible value, the same for equal
+    values with the same dict keys order.
+
+    It is a lot faster than hashing the canonical JSON. Version 0 of marshal
+    doesn't depend on the references and interning of the strings.
+
+    :param value:
+    """
+    return hashlib.sha1(marshal.dumps(value, 0)).hexdigest()
+
+
+def canonical_json(value):
+    """Returns the canonical (sorted keys, no whitespace) JSON of a value
+
+    :param value:
+    """
+    return CANONICAL_ENCODER.encode(value)
+
+
+class LRUCache(object):
+    """A thread safe LRU cache of strings, bounded by their size in bytes.
+
+    Only immutable values (strings) are stored, so callers can't corrupt the
+    cached entries.
+
+    :param max_size: maximum size in bytes of the cached keys and values
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Returns the cached value or None
+
+        :param key:
+        """
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data[key] = value  # most recently used
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used ones to fit it
+
+        :param key:
+        :param value:
+        """
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= sys.getsizeof(key) + sys.getsizeof(old)
+            while self._data and self.size + size > self.max_size:
+                k, v = self._data.popitem(last=False)
+                self.size -= sys.getsizeof(k) + sys.getsizeof(v)
+            self._data[key] = value
+            self.size += size
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        with self._lock:
+            self._data.clear()
+            self.size = self.hits = self.misses = 0
+
+
+class SQLiteCache(object):
+    """A persistent cache of strings in a SQLite file.
+
+    It can be shared by several processes, like the ZEO clients of a host.
+    Entries are evicted least recently used first, based on an access time
+    that is refreshed at most every ``touch_interval`` seconds to avoid a
+    write on each hit. Database errors are logged and handled as misses.
+
+    The number of entries is checked every ``max_entries / 10`` writes of a
+    thread. Once there are more than ``max_entries``, the least recently
+    used ones are evicted down to 90% of ``max_entries``.
+
+    :param path: path of the SQLite file, created if needed
+    :param max_entries: maximum number of cached entries
+    """
+
+    touch_interval = 3600
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_interval = max(1, max_entries // 10)
+        self._local = local()  # a connection per thread
+
+    @property
+    def connection(self):
+        """The SQLite connection of the current thread"""
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT, atime INTEGER)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)")
+            self._local.connection = conn
+        return conn
+
+    def get(self, key):
+        """Returns the cached value or None
+
+        :param key:
+        """
+        try:
+            row = self.connection.execute(
+                "SELECT value, atime FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = int(time.time())
+            if row[1] < now - self.touch_interval:
+                self.connection.execute(
+                    "UPDATE cache SET atime = ? WHERE key = ?", (now, key)
+                )
+            return row[0]
+        except sqlite3.Error:
+            logger.exception("Could not read from the cache %s", self.path)
+            return None
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries
+
+        :param key:
+        :param value:
+        """
+        try:
+            conn = self.connection
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, atime) VALUES (?, ?, ?)",
+                (key, value, int(time.time())),
+            )
+            self._local.writes = getattr(self._local, "writes", 0) + 1
+            if self._local.writes >= self.evict_interval:
+                self._local.writes = 0
+                self.evict()
+        except sqlite3.Error:
+            logger.exception("Could not write to the cache %s", self.path)
+
+    def evict(self):
+        """Evict the least recently used entries down to the low-water mark,
+        if there are more than max_entries
+        """
+        conn = self.connection
+        count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self.max_entries:
+            low_water = self.max_entries - self.max_entries // 10
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                "ORDER BY atime LIMIT ?)",
+                (count - low_water,),
+            )
@@ -1,4 +1,11 @@
 """ config module """
+import os
+
+# Part of the conversion cache keys, so that an upgrade invalidates them
+VERSION = (
+    open(os.path.join(os.path.dirname(__file__), "version.txt")).read().strip()
+)
+
 KNOWN_BLOCK_TYPES = [
     "a",
     "b",
@@ -123,3 +130,50 @@ BLOCK_ELEMENTS = [
 TEXT_NODE = 3
 ELEMENT_NODE = 1
 COMMENT = 8
+
+# Maximum nesting of HTML elements accepted by the iterative (explicit stack)
+# HTML2Slate deserializer and Slate2HTML serializer. It doesn't depend on the
+# python recursion limit
+MAX_NESTING_DEPTH = 10000
+
+# Batch conversions (ISlateConverter.*_many) of fewer items than this are done
+# in the current process, larger ones are spread over a process pool
+BATCH_THRESHOLD = 500
+
+# Size of the batch conversion process pool, None means one per CPU
+BATCH_PROCESSES = None
+
+# Start method of the batch conversion processes. Zope is multi-threaded, a
+# forked process would inherit the locks held by other threads (caches,
+# logging), so they are started by a fork server instead
+BATCH_START_METHOD = "forkserver"
+
+# Size, in bytes, of the in-memory LRU cache of SlateConverter conversions.
+# 0 disables it
+CONVERSION_CACHE_SIZE = 16 * 1024 * 1024
+
+# Size, in bytes, of each of the in-memory LRU caches of the encoded and
+# decoded data-slate-data attributes, see utils.encode_slate_data
+SLATE_DATA_CACHE_SIZE = 1024 * 1024
+
+# Size, in bytes, of the in-memory LRU cache of the content paths by UID used
+# to serialize the internal links of slate blocks, see block.uids_to_paths
+UID_PATH_CACHE_SIZE = 1024 * 1024
+
+# Maximum number of entries in the persistent (SQLite) cache of the HTML
+# block conversions. 0 disables it
+HTML_BLOCK_CACHE_SIZE = int(os.environ.get("slate_html_block_cache_size", 0))
+
+# Path of the SQLite cache file. By default it's slate-html-block-cache.sqlite
+# in the client home (var) directory, which is not shared by the ZEO clients.
+# Set it to a common path, like the buildout var directory, to share the cache
+# between the ZEO clients of a host
+HTML_BLOCK_CACHE_PATH = os.environ.get("slate_html_block_cache_path", "")
+
+# The default HTML parser backend of html2slate, see parsers.PARSERS. Use
+# "python -m eea.volto.slate.benchmark" to find the fastest one for a corpus
+HTML_PARSER = os.environ.get("slate_html_parser", "resiliparse")
+
+# The default slate2html engine, see slate2html.ENGINES. "lxml" builds lxml
+# elements, "string" writes the same HTML directly to strings
+SLATE2HTML_ENGINE = os.environ.get("slate_slate2html_engine", "lxml")
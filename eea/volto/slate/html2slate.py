@@ -3,14 +3,13 @@
 A port of volto-slate' deserialize.js module
 """
 
-import json
 import re
 from collections import deque
 
-from resiliparse.parse.html import HTMLTree
-
-from .config import (DEFAULT_BLOCK_TYPE, ELEMENT_NODE, INLINE_ELEMENTS,
-                     KNOWN_BLOCK_TYPES, TEXT_NODE)
+from .config import (DEFAULT_BLOCK_TYPE, ELEMENT_NODE, HTML_PARSER,
+                     INLINE_ELEMENTS, MAX_NESTING_DEPTH, TEXT_NODE)
+from .parsers import get_parser, parse_fragments
+from .utils import decode_slate_data, get_tag_handlers
 
 SPACE_BEFORE_ENDLINE = re.compile(r"\s+\n", re.M)
 SPACE_AFTER_DEADLINE = re.compile(r"\n\s+", re.M)
@@ -18,9 +17,13 @@ TAB = re.compile(r"\t", re.M)
 LINEBREAK = re.compile(r"\n", re.M)
 MULTIPLE_SPACE = re.compile(r" ( +)", re.M)
 FIRST_SPACE = re.compile("^ ", re.M)
-FIRST_ANY_SPACE = re.compile(r"^\s", re.M)
-FIRST_ALL_SPACE = re.compile(r"^\s+", re.M)
-ANY_SPACE_AT_END = re.compile(r"\s$", re.M)
+
+# Whitespace runs that need rewriting: anything longer than one char or a
+# single char that is not a plain space. Single spaces between words, which
+# are the vast majority, never reach the python callback.
+COLLAPSIBLE_SPACE = re.compile(r"\s{2,}|[^\S ]")
+
+INLINE_TAGS = frozenset(INLINE_ELEMENTS)
 
 
 def is_inline_slate(el):
@@ -45,27 +48,24 @@ def is_inline_slate(el):
 def merge_adjacent_text_nodes(children):
     "Given a list of Slate elements, it combines adjacent texts nodes"
 
-    ranges = []
-    for i, v in enumerate(children):
+    result = []
+    texts = None  # text of the current run of text nodes
+
+    for v in children:
         if "text" in v:
-            if ranges and ranges[-1][1] == i - 1:
-                ranges[-1][1] = i
+            if texts is None:
+                texts = [v["text"]]
             else:
-                ranges.append([i, i])
-    text_positions = []
-    range_dict = {}
-    for start, end in ranges:
-        text_positions.extend(list(range(start, end + 1)))
-        range_dict[start] = end
-
-    result = []
-    for i, v in enumerate(children):
-        if i not in text_positions:
+                texts.append(v["text"])
+        else:
+            if texts is not None:
+                result.append({"text": "".join(texts)})
+                texts = None
             result.append(v)
-        if i in range_dict:
-            result.append(
-                {"text": "".join([c["text"] for c in children[i : range_dict[i] + 1]])}
-            )
+
+    if texts is not None:
+        result.append({"text": "".join(texts)})
+
     return result
 
 
@@ -90,53 +90,64 @@ def remove_space_follow_space(text, node):
 
     text = MULTIPLE_SPACE.sub(" ", text)
 
-    if not text.startswith(" "):
-        return text
+    if text.startswith(" ") and follows_space(node):
+        return FIRST_SPACE.sub("", text)
+
+    return text
+
+
+def follows_space(node, cache=None):
+    """Returns true if the (collapsed) content preceding the node ends with a
+    space, or if there's nothing to precede it in its block
+
+    :param cache: optional dict of already collapsed nodes, see
+        collapse_inline_space
+    """
 
     previous = node.prev
     if previous:
         if previous.type == TEXT_NODE:
-            if previous.text.endswith(" "):
-                return FIRST_SPACE.sub("", text)
+            return previous.text.endswith(" ")
         elif is_inline(previous):
-            prev_text = collapse_inline_space(previous)
-            if prev_text.endswith(" "):
-                return FIRST_SPACE.sub("", text)
-    else:
-        parent = node.parent
-        if parent.prev:
-            prev_text = collapse_inline_space(parent.prev)
-            if prev_text and prev_text.endswith(" "):
-                return FIRST_SPACE.sub("", text)
-        else:
-            return FIRST_SPACE.sub("", text)
+            return collapse_inline_space(previous, cache=cache).endswith(" ")
+        return False
 
-    return text
+    parent = node.parent
+    if parent.prev:
+        prev_text = collapse_inline_space(parent.prev, cache=cache)
+        return bool(prev_text) and prev_text.endswith(" ")
+
+    return True
 
 
 def is_inline(node):
     if isinstance(node, str) or node.type == TEXT_NODE:
         return True
 
-    if node.tag.upper() in INLINE_ELEMENTS:
+    if node.tag.upper() in INLINE_TAGS:
         return True
 
     return False
 
 
 def remove_element_edges(text, node):
-    previous = node.prev
-    next_ = node.next
+    """Sequences of spaces at the beginning and end of an element are removed
+    (rule 5). Expects text that went through the line break collapsing rules.
+    """
+    if not text:
+        return text
+
     parent = node.parent
 
-    if (not is_inline(parent)) and (previous is None) and FIRST_ANY_SPACE.search(text):
-        text = FIRST_ALL_SPACE.sub("", text)
+    if text[0].isspace() and (node.prev is None) and (not is_inline(parent)):
+        text = text.lstrip()
 
-    if ANY_SPACE_AT_END.search(text):
+    if text and text[-1].isspace():
+        next_ = node.next
         if ((next_ is None) and (not is_inline(parent))) or (
             next_ and next_.tag == "br"
         ):
-            text = ANY_SPACE_AT_END.sub("", text)
+            text = text[:-1]
 
     return text
 
@@ -160,40 +171,77 @@ def clean_padding_text(text, node):
     return text
 
 
-def collapse_inline_space(node, expanded=False):
+def _collapse_space_run(match):
+    """Replacement for a single whitespace run, see collapse_whitespace"""
+    run = match.group()
+
+    if "\n" in run:
+        return " "
+
+    run = run.replace("\t", " ")
+    if "  " in run:
+        run = MULTIPLE_SPACE.sub(" ", run)
+
+    return run
+
+
+def collapse_whitespace(text):
+    """Applies, in a single pass, the context-free whitespace rules:
+
+    1. spaces and tabs before and after a line break are ignored
+    2. tabs are handled as spaces
+    3. line breaks are converted to spaces
+    4. consecutive spaces are collapsed to a single space
+
+    The rules never cross the boundary of a whitespace run, so each run is
+    rewritten in isolation.
+    """
+    return COLLAPSIBLE_SPACE.sub(_collapse_space_run, text)
+
+
+def collapse_inline_space(node, expanded=False, cache=None):
     """See
 
     https://developer.mozilla.org/en-US/docs/Web/API/Document_Object_Model/Whitespace
+
+    Rule 4 looks at the collapsed text of the previous sibling, which in turn
+    looks at its own previous sibling. Pass a dict as ``cache`` to collapse
+    each node only once during a conversion; DOM nodes hash by identity.
     """
+    if cache is not None and node in cache:
+        return cache[node]
+
     text = node.text or ""
 
     # 0 (Volto). Return None if is text between block nodes
     text = clean_padding_text(text, node)
 
-    # 1. all spaces and tabs immediately before and after a line break are ignored
-    text = remove_space_before_after_endline(text)
+    # 1-3. Spaces around line breaks are ignored, tabs and line breaks are
+    # converted to spaces. 4. Any space immediately following another space
+    # is ignored
+    text = collapse_whitespace(text)
 
-    # 2. Next, all tab characters are handled as space characters
-    text = convert_tabs_to_spaces(text)
-
-    # 3. Convert all line breaks to spaces
-    text = convert_linebreaks_to_spaces(text)
-
-    # 4. Any space immediately following another space
-    # (even across two separate inline elements) is ignored
-    text = remove_space_follow_space(text, node)
+    # 4. (even across two separate inline elements)
+    if text.startswith(" ") and follows_space(node, cache):
+        text = text[1:]
 
     # 5. Sequences of spaces at the beginning and end of an element are removed
     text = remove_element_edges(text, node)
 
+    if cache is not None:
+        cache[node] = text
+
     return text
 
 
-def fragments_fromstring(text):
-    tree = HTMLTree.parse(text)
-    document = tree.document
-    body = document.query_selector("body")
-    return body.child_nodes
+def fragments_fromstring(text, parser=HTML_PARSER, encoding=None):
+    """Parse the HTML and return the DOM nodes of its body
+
+    :param text: a string or a bytes-like object (bytes, memoryview)
+    :param parser: name of the parser backend, see parsers.PARSERS
+    :param encoding: the encoding of bytes, detected if not given
+    """
+    return parse_fragments(get_parser(parser), text, encoding)
 
 
 class HTML2Slate(object):
@@ -202,19 +250,207 @@ class HTML2Slate(object):
     If you need to handle some custom slate markup, inherit and extend
 
     See https://github.com/plone/volto/blob/5f9066a70b9f3b60d462fc96a1aa7027ff9bbac0/packages/volto-slate/src/editor/deserialize.js
+
+    :param iterative: walk the DOM with an explicit stack instead of
+        recursion, see deserialize_nodes
+    :param max_depth: maximum element nesting accepted in iterative mode
+    :param fused: normalize the children of each element as soon as they are
+        deserialized, instead of walking the whole value again in normalize.
+        Only the elements returned by the handlers are normalized, so their
+        children should come from deserialize_children
+    :param parser: name of the HTML parser backend, see parsers.PARSERS
     """
 
-    def to_slate(self, text):
-        "Convert text to a slate value. A slate value is a list of elements"
+    def __init__(
+        self,
+        iterative=False,
+        max_depth=MAX_NESTING_DEPTH,
+        fused=False,
+        parser=HTML_PARSER,
+    ):
+        self.iterative = iterative
+        self.max_depth = max_depth
+        self.fused = fused
+        self.parser = get_parser(parser)
+        # tagname -> handle_tag_* function, see get_tag_handlers
+        self.handlers = get_tag_handlers(type(self))
+        # collapsed text of DOM nodes, valid for a single conversion
+        self.collapsed_text = {}
+        # (node, children list) waiting to be deserialized, in iterative mode
+        self.pending = None
+
+    def to_slate(self, text, encoding=None):
+        """Convert text to a slate value. A slate value is a list of elements
+
+        :param text: a string or a bytes-like object (bytes, memoryview)
+        :param encoding: the encoding of bytes, detected if not given
+        """
+
+        fragments = parse_fragments(self.parser, text, encoding)
+        try:
+            nodes = self.deserialize_fragments(fragments)
+        finally:
+            # don't keep the parsed tree alive
+            self.collapsed_text = {}
+
+        if self.fused:
+            return self._normalize_top_level(nodes)
+        return self.normalize(nodes)
+
+    def update_slate(self, old_text, old_value, text, encoding=None):
+        """Convert text to a slate value, given old_value, the slate value of
+        old_text. Only the top-level fragments of the HTML that changed since
+        old_text are deserialized, the slate elements of the unchanged ones
+        are taken from old_value (they're not copied).
+
+        The unchanged fragments are found at the start and at the end of the
+        HTML. They need to be block fragments (see is_block_fragment),
+        because the whitespace rules make the deserialization of text and
+        inline elements depend on their siblings. Falls back to to_slate
+        when old_value doesn't match old_text.
+
+        :param old_text: the previous HTML
+        :param old_value: the slate value of old_text
+        :param text: the new HTML
+        :param encoding: the encoding of bytes, detected if not given
+        """
+        old = list(parse_fragments(self.parser, old_text, encoding))
+        new = list(parse_fragments(self.parser, text, encoding))
+
+        start, before = self._unchanged_blocks(old, new)
+        end, after = self._unchanged_blocks(old[start:][::-1], new[start:][::-1])
+
+        try:
+            old_nodes = self.deserialize_fragments(old[start : len(old) - end])
+            self.collapsed_text = {}
+            nodes = self.deserialize_fragments(new[start : len(new) - end])
+        finally:
+            self.collapsed_text = {}
+
+        old_nodes = [v for v in old_nodes if v is not None]
+        nodes = [v for v in nodes if v is not None]
+
+        if len(old_value) != before + len(old_nodes) + after:
+            return self.to_slate(text, encoding)
+
+        if not before and (
+            (old_nodes and is_inline_slate(old_nodes[0]))
+            or (nodes and is_inline_slate(nodes[0]))
+        ):
+            # the whole value is wrapped in a block, see normalize
+            return self.to_slate(text, encoding)
+
+        if not self.fused:
+            self._normalize_elements(nodes)
+
+        return old_value[:before] + nodes + old_value[len(old_value) - after :]
+
+    def is_block_fragment(self, node):
+        """Returns true if a top-level DOM node is deserialized as a single
+        slate element, independently of its siblings
+
+        :param node:
+        """
+        if node.type != ELEMENT_NODE or is_inline(node):
+            return False
+        if "data-slate-data" in node.attrs:
+            return True
+        return self.handlers.get(node.tag) is type(self).handle_block
+
+    def _unchanged_blocks(self, old, new):
+        """Returns the length of the common start of two lists of top-level
+        DOM nodes, ending with a block fragment, and its number of block
+        fragments. Only whitespace text, which is dropped between elements,
+        is accepted between the block fragments.
+        """
+        length = blocks = 0
+        for i, (a, b) in enumerate(zip(old, new)):
+            if a.type == TEXT_NODE and b.type == TEXT_NODE:
+                if is_whitespace(a.text) and is_whitespace(b.text):
+                    continue
+                break
+            if not (self.is_block_fragment(a) and a.html == b.html):
+                break
+            length = i + 1
+            blocks += 1
+        return length, blocks
+
+    def iter_slate(self, text, encoding=None):
+        """Convert text to a slate value, yielding the normalized top-level
+        nodes as soon as each top-level fragment of the HTML is deserialized.
+
+        Together, the yielded nodes are the to_slate value. If the HTML starts
+        with inline content, the whole value is wrapped in a single default
+        block (like in normalize) which can only be yielded at the end.
+
+        :param text: a string or a bytes-like object (bytes, memoryview)
+        :param encoding: the encoding of bytes, detected if not given
+        """
+        fragments = parse_fragments(self.parser, text, encoding)
+        wrapped = None  # leading inline content, see normalize
+        streaming = False
+
+        try:
+            for f in fragments:
+                if self.iterative:
+                    nodes = self.deserialize_nodes([f])
+                else:
+                    nodes = self.deserialize(f)
+                nodes = [v for v in nodes or [] if v is not None]
+
+                # only the next fragment can look back at this one. Collapse
+                # an inline fragment now, while the previous one is still
+                # memoized, or the next one walks back all the fragments
+                collapsed = self.collapsed_text.get(f)
+                if collapsed is None and is_inline(f):
+                    collapsed = collapse_inline_space(f, cache=self.collapsed_text)
+                self.collapsed_text = {}
+                if collapsed is not None:
+                    self.collapsed_text[f] = collapsed
+
+                if not nodes:
+                    continue
+
+                if wrapped is None and not streaming:
+                    if is_inline_slate(nodes[0]):
+                        wrapped = []
+                    else:
+                        streaming = True
+
+                if wrapped is not None:
+                    wrapped += nodes
+                    continue
+
+                if not self.fused:
+                    self._normalize_elements(nodes)
+                for node in nodes:
+                    yield node
+        finally:
+            self.collapsed_text = {}
+
+        if wrapped is not None:
+            if self.fused:
+                wrapped = self._normalize_top_level(wrapped)
+            else:
+                wrapped = self.normalize(wrapped)
+            for node in wrapped:
+                yield node
+
+    def deserialize_fragments(self, fragments):
+        """Deserialize the top-level DOM nodes, returns the list of their not
+        yet normalized slate nodes
+
+        :param fragments:
+        """
+        if self.iterative:
+            return self.deserialize_nodes(fragments)
 
-        fragments = fragments_fromstring(text)
         nodes = []
         for f in fragments:
             slate_nodes = self.deserialize(f)
             if slate_nodes:
                 nodes += slate_nodes
-
-        return self.normalize(nodes)
+        return nodes
 
     def deserialize(self, node):
         """Deserialize a node into a list Slate Nodes"""
@@ -223,38 +459,46 @@ class HTML2Slate(object):
             return []
 
         if node.tag == "#text":
-            text = collapse_inline_space(node)
+            text = collapse_inline_space(node, cache=self.collapsed_text)
             return [{"text": text}] if text else None
         elif node.type != ELEMENT_NODE:
             return None
 
-        tagname = node.tag
-        handler = None
-
         if "data-slate-data" in node.attrs:
-            handler = self.handle_slate_data_element
+            slate_node = self.handle_slate_data_element(node)
         else:
-            handler = getattr(self, "handle_tag_{}".format(tagname), None)
-            if not handler and tagname in KNOWN_BLOCK_TYPES:
-                handler = self.handle_block
+            handler = self.handlers.get(node.tag)
+            if handler is None:
+                # fallback, "skips" the node
+                return self.handle_fallback(node)
+            slate_node = handler(self, node)
 
-        if handler:
-            slate_node = handler(node)
-            if not isinstance(slate_node, list):
-                slate_node = [slate_node]
-            return slate_node
+        if not isinstance(slate_node, list):
+            slate_node = [slate_node]
 
-        # fallback, "skips" the node
-        return self.handle_fallback(node)
+        if self.fused and self.pending is None:
+            for element in slate_node:
+                children = element.get("children") if element else None
+                if children is not None:
+                    element["children"] = self._normalize_children(children)
+
+        return slate_node
 
     def deserialize_children(self, node):
         """deserialize_children.
 
+        In iterative mode the children are not deserialized here: an empty
+        list is returned and filled in later by deserialize_nodes.
+
         :param node:
         """
 
         res = []
 
+        if self.pending is not None:
+            self.pending.append((node, res))
+            return res
+
         for child in node.child_nodes:
             b = self.deserialize(child)
             if isinstance(b, list):
@@ -264,6 +508,59 @@ class HTML2Slate(object):
 
         return res
 
+    def deserialize_nodes(self, nodes):
+        """Deserialize a list of sibling DOM nodes without recursion.
+
+        The handlers are called in the same order as with the recursive
+        deserialize, but the children lists they get from
+        deserialize_children are filled in from an explicit stack. A handler
+        that returns such a list as is (like handle_fallback) has the
+        children spliced in place of the node.
+
+        Raises ValueError if elements are nested deeper than max_depth.
+
+        :param nodes:
+        """
+        res = []
+        # (child nodes iterator, target list, target is an element children)
+        stack = [(iter(nodes), res, False)]
+        self.pending = pending = []
+
+        try:
+            while stack:
+                children, target, is_children = stack[-1]
+                node = next(children, None)
+                if node is None:
+                    stack.pop()
+                    if is_children and self.fused:
+                        target[:] = self._normalize_children(target)
+                    continue
+
+                b = self.deserialize(node)
+
+                if pending:
+                    if len(stack) > self.max_depth:
+                        raise ValueError(
+                            "HTML is nested deeper than {} elements".format(
+                                self.max_depth
+                            )
+                        )
+                    for child, placeholder in reversed(pending):
+                        if placeholder is b:
+                            stack.append((iter(child.child_nodes), target, False))
+                        else:
+                            stack.append((iter(child.child_nodes), placeholder, True))
+                    del pending[:]
+
+                if isinstance(b, list):
+                    target += b
+                elif b:
+                    target.append(b)
+        finally:
+            self.pending = None
+
+        return res
+
     def handle_tag_a(self, node):
         """handle_tag_a.
 
@@ -314,7 +611,7 @@ class HTML2Slate(object):
 
         :param node:
         """
-        element = json.loads(node["data-slate-data"])
+        element = decode_slate_data(node["data-slate-data"])
         element["children"] = self.deserialize_children(node)
         return element
 
@@ -332,20 +629,45 @@ class HTML2Slate(object):
         if value and [x for x in value if is_inline_slate(value[0])]:
             value = [{"type": DEFAULT_BLOCK_TYPE, "children": value}]
 
+        self._normalize_elements(value)
+
+        return value
+
+    def _normalize_top_level(self, value):
+        """The top-level part of normalize, for values whose elements already
+        have normalized children (fused mode)
+        """
+
+        value = [v for v in value if v is not None]
+
+        if value and is_inline_slate(value[0]):
+            children = self._normalize_children(value)
+            value = [{"type": DEFAULT_BLOCK_TYPE, "children": children}]
+
+        return value
+
+    def _normalize_elements(self, value):
+        """Normalize, in place, the children of the elements in value and of
+        all their descendants
+        """
+
         stack = deque(value)
 
         while stack:
             child = stack.pop()
             children = child.get("children", None)
             if children is not None:
-                children = [c for c in children if c]
-                # merge adjacent text nodes
-                child["children"] = merge_adjacent_text_nodes(children)
+                child["children"] = self._normalize_children(children)
                 stack.extend(child["children"])
 
-                self._pad_with_space(child["children"])
+    def _normalize_children(self, children):
+        """Returns the normalized list of an element's children"""
 
-        return value
+        children = [c for c in children if c]
+        # merge adjacent text nodes
+        children = merge_adjacent_text_nodes(children)
+        self._pad_with_space(children)
+        return children
 
     def _pad_with_space(self, children):
         """Mutate the children array in-place. It pads them with
@@ -377,12 +699,25 @@ class HTML2Slate(object):
             children.append({"text": ""})
 
 
-def text_to_slate(text):
+def text_to_slate(text, encoding=None):
     """text_to_slate.
 
-    :param text:
+    :param text: a string or a bytes-like object (bytes, memoryview)
+    :param encoding: the encoding of bytes, detected if not given
+    """
+    return HTML2Slate().to_slate(text, encoding)
+
+
+def update_slate(old_text, old_value, text, encoding=None):
+    """Convert text to slate, reusing old_value for the unchanged fragments,
+    see HTML2Slate.update_slate
+
+    :param old_text: the previous HTML
+    :param old_value: the slate value of old_text
+    :param text: the new HTML
+    :param encoding: the encoding of bytes, detected if not given
     """
-    return HTML2Slate().to_slate(text)
+    return HTML2Slate().update_slate(old_text, old_value, text, encoding)
 
 
 def is_whitespace(text):
@@ -393,4 +728,4 @@ def is_whitespace(text):
     if not isinstance(text, str):
         return False
 
-    return len(re.sub(r"\s|\t|\n", "", text)) == 0
+    return not text.strip()
@@ -1,6 +1,8 @@
 """ Transformers to store the slate HTML value serialized as HTML
 """
-
+import json
+import logging
+import os
 
 from plone.restapi.behaviors import IBlocks
 from plone.restapi.interfaces import (IBlockFieldDeserializationTransformer,
@@ -10,7 +12,41 @@ from zope.component import adapter, getUtility
 from zope.interface import implementer
 from zope.publisher.interfaces.browser import IBrowserRequest
 
+from .cache import SQLiteCache, digest
+from .config import (HTML_BLOCK_CACHE_PATH, HTML_BLOCK_CACHE_SIZE,
+                     HTML_PARSER, VERSION)
 from .interfaces import ISlateConverter
+from .utils import json_loads
+
+logger = logging.getLogger("eea.volto.slate")
+
+_CACHE = []
+
+
+def html_block_cache():
+    """Returns the persistent conversion cache of the HTML blocks, or None if
+    it's disabled, see config.HTML_BLOCK_CACHE_SIZE. It's only shared by the
+    ZEO clients with the same config.HTML_BLOCK_CACHE_PATH
+    """
+    if not HTML_BLOCK_CACHE_SIZE:
+        return None
+
+    if not _CACHE:
+        path = HTML_BLOCK_CACHE_PATH
+        if not path:
+            from App.config import getConfiguration
+
+            path = os.path.join(
+                getConfiguration().clienthome, "slate-html-block-cache.sqlite"
+            )
+            logger.info(
+                "The HTML block cache %s is only used by this client, set "
+                "slate_html_block_cache_path to share it with other clients",
+                path,
+            )
+        _CACHE.append(SQLiteCache(path, HTML_BLOCK_CACHE_SIZE))
+
+    return _CACHE[0]
 
 
 @implementer(IBlockFieldSerializationTransformer)
@@ -28,8 +64,22 @@ class SlateHTMLBlockSerializer(object):
 
     def __call__(self, block):
 
-        value = getattr(block, self.field, [])
-        block["value"] = getUtility(ISlateConverter).html2slate(value)
+        value = block.get(self.field) or ""
+        cache = html_block_cache()
+
+        if cache is None:
+            block["value"] = getUtility(ISlateConverter).html2slate(value)
+            return block
+
+        # the parser backends fix broken markup differently
+        key = digest("html2slate", VERSION, HTML_PARSER, value)
+        cached = cache.get(key)
+        if cached is not None:
+            block["value"] = json_loads(cached)
+        else:
+            block["value"] = getUtility(ISlateConverter).html2slate(value)
+            cache.set(key, json.dumps(block["value"]))
+
         return block
 
 
@@ -54,7 +104,9 @@ class SlateHTMLBlockDeserializer(object):
 
     def __call__(self, block):
 
-        value = getattr(block, self.field, [])
+        # the converter reuses the cached HTML of the unchanged top-level
+        # nodes, see SlateConverter.slate2html
+        value = block.get(self.field) or []
         block["value"] = getUtility(ISlateConverter).slate2html(value)
         return block
 
@@ -23,4 +23,22 @@ class ISlateConverter(Interface):
         """ Convert HTML to slate value """
 
     def slate2html():
-        """ Convert Slate value to slate HTML """
+        """ Convert Slate value to slate HTML, with the slate2html engine of
+        the utility (see config.SLATE2HTML_ENGINE)
+        """
+
+    def html2slate_many(texts, processes=None, threshold=None):
+        """ Convert a sequence of HTML strings to slate values, in order.
+
+        An item that can't be converted gets a ConversionError instead of its
+        value. Batches of at least ``threshold`` items are spread over a pool
+        of ``processes`` worker processes.
+        """
+
+    def slate2html_many(values, processes=None, threshold=None):
+        """ Convert a sequence of slate values to HTML, like html2slate_many
+        """
+
+
+class ConversionError(Exception):
+    """An item of a batch conversion could not be converted"""
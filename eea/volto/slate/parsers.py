@@ -0,0 +1,285 @@
+""" HTML parser backends for html2slate
+
+HTML2Slate walks a DOM with this node API: ``tag`` ("#text" for text
+nodes), ``type`` (see config.ELEMENT_NODE, TEXT_NODE), ``text`` (the text
+content), ``html`` (the outer HTML of elements), ``prev``, ``next``,
+``parent``, ``child_nodes``, ``attrs`` (the attribute names) and
+``node[attribute]``. Nodes need to be hashable by identity.
+
+Resiliparse nodes provide it natively; lxml trees are wrapped in LxmlNode.
+
+Backends parse text with ``fragments_fromstring(text)`` and bytes-like
+objects with ``fragments_frombytes(data, encoding)``.
+"""
+# pylint: disable=too-few-public-methods
+import codecs
+import re
+
+from lxml import etree
+from lxml.html import HTMLParser
+from resiliparse.parse.html import HTMLTree
+
+from .config import COMMENT, ELEMENT_NODE, TEXT_NODE
+
+# libxml2 stops at 256 levels of nesting otherwise, silently dropping the rest
+# of the document
+LXML_HTML_PARSER = HTMLParser(huge_tree=True)
+
+# like lxml.html, markup that starts with these tags is a full document
+FULL_DOCUMENT = re.compile(r"^\s*<(?:html|!doctype)", re.I)
+FULL_DOCUMENT_BYTES = re.compile(br"^\s*<(?:html|!doctype)", re.I)
+
+# libxml2 drops or misplaces the content after these end tags, which HTML5
+# parsers ignore
+STRAY_END_TAGS = re.compile(r"</(?:body|html)\s*>", re.I)
+STRAY_END_TAGS_BYTES = re.compile(br"</(?:body|html)\s*>", re.I)
+
+# memoryviews are fed to lxml in chunks of this size, lxml only takes bytes
+CHUNK_SIZE = 64 * 1024
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+]
+
+META_CHARSET = re.compile(br"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.I)
+
+
+def detect_encoding(data):
+    """Returns an (encoding, byte order mark) tuple for HTML bytes.
+
+    The encoding comes from the byte order mark, or from a <meta> charset
+    declaration in the first 1024 bytes, and defaults to utf-8. The byte
+    order mark is b"" if there's none.
+
+    :param data: a bytes-like object
+    """
+    head = bytes(data[:1024])
+
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, bom
+
+    encoding = "utf-8"
+    match = META_CHARSET.search(head)
+    if match:
+        encoding = match.group(1).decode("ascii").lower()
+        try:
+            encoding = codecs.lookup(encoding).name
+        except LookupError:
+            encoding = "utf-8"
+        # a utf-16/32 declaration in ASCII compatible markup is wrong
+        if encoding.startswith(("utf-16", "utf-32")):
+            encoding = "utf-8"
+
+    return encoding, b""
+
+
+class ResiliparseParser(object):
+    """Parse with resiliparse (lexbor), an HTML5 compliant parser"""
+
+    name = "resiliparse"
+
+    def fragments_fromstring(self, text):
+        """Returns the DOM nodes in the body of the parsed HTML
+
+        :param text:
+        """
+        # the parser always synthesizes html, head and body, go straight to
+        # the body instead of querying the document for it
+        return HTMLTree.parse(text).body.child_nodes
+
+    def fragments_frombytes(self, data, encoding):
+        """Returns the DOM nodes in the body of the parsed HTML bytes
+
+        :param data: a bytes-like object, without byte order mark
+        :param encoding:
+        """
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        return HTMLTree.parse_from_bytes(data, encoding).body.child_nodes
+
+
+class LxmlNode(object):
+    """A DOM node wrapping an lxml element, comment or text"""
+
+    __slots__ = (
+        "tag",
+        "type",
+        "attrs",
+        "parent",
+        "prev",
+        "next",
+        "child_nodes",
+        "_element",
+        "_text",
+    )
+
+    def __init__(self, tag, type_, parent, element=None, text=None):
+        self.tag = tag
+        self.type = type_
+        self.parent = parent
+        self.attrs = element.attrib if type_ == ELEMENT_NODE else {}
+        self.prev = None
+        self.next = None
+        self.child_nodes = []
+        self._element = element
+        self._text = text
+
+    @property
+    def text(self):
+        """The text of a text node, the text content of an element"""
+        if self._text is None:
+            self._text = "".join(self._element.itertext())
+        return self._text
+
+    @property
+    def html(self):
+        """The outer HTML of an element, the text of other nodes"""
+        if self.type != ELEMENT_NODE:
+            return self.text
+        return etree.tostring(
+            self._element, method="html", encoding="unicode", with_tail=False
+        )
+
+    def __getitem__(self, name):
+        return self.attrs[name]
+
+
+def wrap_lxml_element(element, parent=None):
+    """Wrap an lxml element, and its whole subtree, in LxmlNode objects
+
+    :param element:
+    :param parent: the LxmlNode of the parent element
+    """
+    root = LxmlNode(element.tag, ELEMENT_NODE, parent, element)
+    stack = [root]
+
+    while stack:
+        node = stack.pop()
+        el = node._element  # pylint: disable=protected-access
+        children = node.child_nodes
+
+        if el.text:
+            children.append(LxmlNode("#text", TEXT_NODE, node, text=el.text))
+
+        for child in el:
+            if isinstance(child.tag, str):
+                child_node = LxmlNode(child.tag, ELEMENT_NODE, node, child)
+                stack.append(child_node)
+            else:
+                # comments, processing instructions are handled as comments
+                child_node = LxmlNode("#comment", COMMENT, node, text="")
+            children.append(child_node)
+
+            if child.tail:
+                children.append(LxmlNode("#text", TEXT_NODE, node, text=child.tail))
+
+        for prev, next_ in zip(children, children[1:]):
+            prev.next = next_
+            next_.prev = prev
+
+    return root
+
+
+class LxmlParser(object):
+    """Parse with the lxml (libxml2) HTML parser"""
+
+    name = "lxml"
+
+    def fragments_fromstring(self, text):
+        """Returns the DOM nodes in the body of the parsed HTML
+
+        :param text:
+        """
+        text = STRAY_END_TAGS.sub("", text)
+        if not FULL_DOCUMENT.match(text):
+            # parse the text directly as body content
+            text = "<html><body>{}</body></html>".format(text)
+        return self.wrap_body(etree.fromstring(text, LXML_HTML_PARSER))
+
+    def fragments_frombytes(self, data, encoding):
+        """Returns the DOM nodes in the body of the parsed HTML bytes, which
+        are fed as they are to the parser
+
+        :param data: a bytes-like object, without byte order mark
+        :param encoding:
+        """
+        try:
+            parser = HTMLParser(encoding=encoding, huge_tree=True)
+            # the tags can only be found in ASCII compatible bytes
+            ascii_compatible = u"</body>".encode(encoding) == b"</body>"
+        except LookupError:  # unknown to libxml2 or python
+            ascii_compatible = False
+        if not ascii_compatible:
+            return self.fragments_fromstring(
+                bytes(data).decode(encoding, "replace")
+            )
+
+        if STRAY_END_TAGS_BYTES.search(data):
+            data = STRAY_END_TAGS_BYTES.sub(b"", data)
+        if not FULL_DOCUMENT_BYTES.match(data):
+            # parse the bytes directly as body content
+            parser.feed(b"<html><body>")
+        if isinstance(data, bytes):
+            parser.feed(data)
+        else:
+            view = memoryview(data)
+            for i in range(0, len(view), CHUNK_SIZE):
+                parser.feed(view[i : i + CHUNK_SIZE].tobytes())
+
+        return self.wrap_body(parser.close())
+
+    def wrap_body(self, root):
+        """Returns the wrapped DOM nodes of the body of a parsed document
+
+        :param root: the lxml html element
+        """
+        body = root.find("body")
+        if body is None:
+            return []
+
+        # a document with an empty head, like the one built by resiliparse
+        html = LxmlNode("html", ELEMENT_NODE, None, etree.Element("html"))
+        head = LxmlNode("head", ELEMENT_NODE, html, etree.Element("head"))
+        body = wrap_lxml_element(body, html)
+        head.next, body.prev = body, head
+        html.child_nodes = [head, body]
+
+        return body.child_nodes
+
+
+def parse_fragments(parser, text, encoding=None):
+    """Returns the DOM nodes in the body of the parsed HTML
+
+    :param parser: a parser backend
+    :param text: a string or a bytes-like object (bytes, memoryview)
+    :param encoding: the encoding of bytes, see detect_encoding if not given
+    """
+    if not isinstance(text, (bytes, bytearray, memoryview)):
+        return parser.fragments_fromstring(text)
+
+    detected, bom = detect_encoding(text)
+    if bom:
+        text = memoryview(text)[len(bom) :]
+    return parser.fragments_frombytes(text, encoding or detected)
+
+
+PARSERS = {
+    ResiliparseParser.name: ResiliparseParser,
+    LxmlParser.name: LxmlParser,
+}
+
+
+def get_parser(name):
+    """Returns an instance of the named parser backend
+
+    :param name: one of the PARSERS keys
+    """
+    try:
+        return PARSERS[name]()
+    except KeyError:
+        raise ValueError("Unknown HTML parser: {}".format(name))
@@ -1,12 +1,35 @@
 """ slate2html module """
 # pylint: disable=import-error,no-name-in-module,too-few-public-methods,
 # pylint: disable=not-callable,no-self-use,unused-argument,invalid-name
-import json
+import logging
+import re
 
 from lxml.html import builder as E
 from lxml.html import tostring
 
-from .config import KNOWN_BLOCK_TYPES
+from .config import KNOWN_BLOCK_TYPES, MAX_NESTING_DEPTH, SLATE2HTML_ENGINE
+from .utils import encode_slate_data, get_tag_handlers
+
+try:
+    from urllib.parse import quote
+except ImportError:  # Python 2
+    from urllib import quote
+
+logger = logging.getLogger("eea.volto.slate")
+
+# characters that lxml refuses in text and attribute values
+XML_INCOMPATIBLE = re.compile(u"[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")
+
+# attributes serialized as URIs by libxml2: space, control and non-ASCII
+# characters are %-escaped, leading whitespace is removed
+URI_ATTRIBUTES = ("href", "src", "action")
+URI_SAFE = "".join(chr(c) for c in range(0x21, 0x7F))
+
+# elements that libxml2 serializes without end tag, when they're empty
+OPTIONAL_END_TAGS = ("li",)
+
+# libxml2 doesn't escape the "&{...}" script macros of HTML 4 in attributes
+SCRIPT_MACRO = re.compile(r"(&\{[^}]*\})")
 
 
 def join(element, children):
@@ -22,8 +45,36 @@ def join(element, children):
     return res[:-1]  # remove the last break
 
 
+def append_child(parent, child):
+    """Append a serialized child to an lxml element, like the lxml builder
+
+    :param parent: an lxml element
+    :param child: a string, an lxml element or a builder (like E.BR)
+    """
+    if isinstance(child, str):
+        if len(parent):
+            parent[-1].tail = (parent[-1].tail or "") + child
+        else:
+            parent.text = (parent.text or "") + child
+    else:
+        parent.append(child() if callable(child) else child)
+
+
 class Slate2HTML(object):
-    """Slate2HTML."""
+    """Slate2HTML.
+
+    :param iterative: walk the slate value with an explicit stack instead of
+        recursion, see serialize_nodes
+    :param max_depth: maximum element nesting accepted in iterative mode
+    """
+
+    def __init__(self, iterative=False, max_depth=MAX_NESTING_DEPTH):
+        self.iterative = iterative
+        self.max_depth = max_depth
+        # tagname -> handle_tag_* function, see get_tag_handlers
+        self.handlers = get_tag_handlers(type(self))
+        # (element, children list) waiting to be serialized, in iterative mode
+        self.pending = None
 
     def serialize(self, element):
         """serialize.
@@ -38,18 +89,87 @@ class Slate2HTML(object):
 
         tagname = element["type"]
 
-        if element.get("data") and element["type"] not in KNOWN_BLOCK_TYPES:
-            handler = self.handle_slate_data_element
+        if element.get("data") and tagname not in KNOWN_BLOCK_TYPES:
+            res = self.handle_slate_data_element(element)
         else:
-            handler = getattr(self, "handle_tag_{}".format(tagname), None)
-            if not handler and tagname in KNOWN_BLOCK_TYPES:
-                handler = self.handle_block
+            handler = self.handlers.get(tagname)
+            res = handler(self, element)
 
-        res = handler(element)
         if isinstance(res, list):
             return res
         return [res]
 
+    def serialize_children(self, element):
+        """serialize_children.
+
+        In iterative mode the children are not serialized here: an empty
+        list is returned, and serialize_nodes adds the children to the lxml
+        element that the handler builds with it.
+
+        :param element:
+        """
+        res = []
+
+        if self.pending is not None:
+            self.pending.append((element, res))
+            return res
+
+        for child in element["children"]:
+            res += self.serialize(child)
+
+        return res
+
+    def serialize_nodes(self, nodes):
+        """Serialize a list of sibling slate nodes without recursion.
+
+        The handlers are called in the same order as with the recursive
+        serialize. The children of an element are appended, from an explicit
+        stack, to the lxml element returned by its handler, no intermediate
+        lists are built. A handler that returns the serialize_children list
+        as is has the children spliced in place of the element.
+
+        Raises ValueError if elements are nested deeper than max_depth.
+
+        :param nodes:
+        """
+        res = []
+        # (slate children iterator, target list or lxml element)
+        stack = [(iter(nodes), res)]
+        self.pending = pending = []
+
+        try:
+            while stack:
+                children, target = stack[-1]
+                try:
+                    node = next(children)
+                except StopIteration:
+                    stack.pop()
+                    continue
+
+                b = self.serialize(node)
+
+                if pending:
+                    if len(stack) > self.max_depth:
+                        raise ValueError(
+                            "Slate value is nested deeper than {} elements".format(
+                                self.max_depth
+                            )
+                        )
+                    for element, placeholder in reversed(pending):
+                        parent = target if placeholder is b else b[-1]
+                        stack.append((iter(element["children"]), parent))
+                    del pending[:]
+
+                if isinstance(target, list):
+                    target += b
+                else:
+                    for child in b:
+                        append_child(target, child)
+        finally:
+            self.pending = None
+
+        return res
+
     def handle_tag_a(self, element):
         """handle_tag_a.
 
@@ -69,9 +189,7 @@ class Slate2HTML(object):
 
         el = getattr(E, element["type"].upper())
 
-        children = []
-        for child in element["children"]:
-            children += self.serialize(child)
+        children = self.serialize_children(element)
 
         return el(*children, **attributes)
 
@@ -82,12 +200,10 @@ class Slate2HTML(object):
         """
         el = E.SPAN
 
-        children = []
-        for child in element["children"]:
-            children += self.serialize(child)
+        children = self.serialize_children(element)
 
         data = {"type": element["type"], "data": element["data"]}
-        attributes = {"data-slate-data": json.dumps(data)}
+        attributes = {"data-slate-data": encode_slate_data(data)}
 
         return el(*children, **attributes)
 
@@ -98,9 +214,7 @@ class Slate2HTML(object):
         """
         el = getattr(E, element["type"].upper())
 
-        children = []
-        for child in element["children"]:
-            children += self.serialize(child)
+        children = self.serialize_children(element)
 
         return el(*children)
 
@@ -109,18 +223,268 @@ class Slate2HTML(object):
 
         :param value:
         """
-        children = []
-        for child in value:
-            children += self.serialize(child)
+        if self.iterative:
+            children = self.serialize_nodes(value)
+        else:
+            children = []
+            for child in value:
+                children += self.serialize(child)
 
         # TO DO: handle unicode properly
         return u"".join(tostring(f).decode("utf-8") for f in children)
 
+    def iter_html(self, value):
+        """Generate the HTML of each top-level node of the value, as soon as
+        it is serialized
+
+        :param value:
+        """
+        for child in value:
+            yield self.to_html([child])
+
+    def write_html(self, value, fp):
+        """Write the HTML of the value to a file-like object, one top-level
+        node at a time
+
+        :param value:
+        :param fp: a file-like object open in text mode
+        """
+        for html in self.iter_html(value):
+            fp.write(html)
+
+
+def check_xml_compatible(text):
+    """Raise a ValueError for text that lxml can't store in an element
+
+    :param text:
+    """
+    if XML_INCOMPATIBLE.search(text):
+        raise ValueError(
+            "All strings must be XML compatible: Unicode or ASCII, "
+            "no NULL bytes or control characters"
+        )
+
+
+def escape_text(text):
+    """Escape text like the lxml (libxml2) HTML serializer, with character
+    references for non-ASCII characters
+
+    :param text:
+    """
+    check_xml_compatible(text)
+    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return text.encode("ascii", "xmlcharrefreplace").decode("ascii")
+
+
+def escape_attribute(value, uri=False):
+    """Escape and quote an attribute value like the lxml (libxml2) HTML
+    serializer
+
+    :param value:
+    :param uri: escape the value as an URI, see URI_ATTRIBUTES
+    """
+    check_xml_compatible(value)
+    if uri:
+        value = quote(value.lstrip(" \t\n\r").encode("utf-8"), URI_SAFE)
+
+    quote_char = "'" if '"' in value and "'" not in value else '"'
+
+    parts = SCRIPT_MACRO.split(value) if "&{" in value else [value]
+    for i in range(0, len(parts), 2):
+        parts[i] = (
+            parts[i].replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        )
+    value = "".join(parts)
+    if quote_char == '"':
+        value = value.replace('"', "&quot;")
+
+    value = value.encode("ascii", "xmlcharrefreplace").decode("ascii")
+    return quote_char + value + quote_char
+
+
+def start_tag(tagname, attributes=None):
+    """Returns the HTML start tag of an element
+
+    :param tagname:
+    :param attributes: a {name: value} mapping
+    """
+    if not attributes:
+        return "<{}>".format(tagname)
+
+    return "<{}{}>".format(
+        tagname,
+        "".join(
+            " {}={}".format(name, escape_attribute(value, name in URI_ATTRIBUTES))
+            for name, value in attributes.items()
+        ),
+    )
+
+
+class StringSlate2HTML(object):
+    """Slate2HTML without lxml elements, the HTML is written directly to a
+    list of strings. It produces the same HTML as Slate2HTML.
+
+    Handlers return the start and end tags of an element, its children are
+    serialized in between.
+    """
+
+    def __init__(self):
+        # tagname -> handle_tag_* function, see get_tag_handlers
+        self.handlers = get_tag_handlers(type(self))
+
+    def serialize(self, element, out):
+        """Serialize an element and its descendants, with an explicit stack
+        of the end tags instead of recursion
+
+        :param element:
+        :param out: the list of HTML strings
+        """
+        # slate children iterators, and the end tags of their parents
+        stack = [iter([element])]
+        ends = [""]
+
+        while stack:
+            for element in stack[-1]:
+                if "text" in element:
+                    out.append(escape_text(element["text"]).replace("\n", "<br>"))
+                    continue
+
+                tagname = element["type"]
+
+                if element.get("data") and tagname not in KNOWN_BLOCK_TYPES:
+                    start, end = self.handle_slate_data_element(element)
+                else:
+                    handler = self.handlers.get(tagname)
+                    start, end = handler(self, element)
+
+                out.append(start)
+                ends.append(end)
+                stack.append(iter(element["children"]))
+                break
+            else:
+                stack.pop()
+                out.append(ends.pop())
+
+    def handle_tag_a(self, element):
+        """handle_tag_a.
+
+        :param element:
+        """
+        internal_link = (
+            element.get("data", {})
+            .get("link", {})
+            .get("internal", {})
+            .get("internal_link", [])
+        )
+
+        attributes = {}
+
+        if internal_link:
+            attributes["href"] = internal_link[0]["@id"]
+
+        return start_tag("a", attributes), "</a>"
+
+    def handle_slate_data_element(self, element):
+        """handle_slate_data_element.
+
+        :param element:
+        """
+        data = {"type": element["type"], "data": element["data"]}
+        attributes = {"data-slate-data": encode_slate_data(data)}
+
+        return start_tag("span", attributes), "</span>"
+
+    def handle_block(self, element):
+        """handle_block.
+
+        :param element:
+        """
+        tagname = element["type"]
+        if tagname in OPTIONAL_END_TAGS and not element["children"]:
+            return start_tag(tagname), ""
+        return start_tag(tagname), "</{}>".format(tagname)
+
+    def to_html(self, value):
+        """to_html.
+
+        :param value:
+        """
+        out = []
+        has_text = False
+        for child in value:
+            if "text" in child:
+                has_text = True
+                continue
+            start = len(out)
+            try:
+                self.serialize(child, out)
+            except ValueError:
+                # invalid text, let lxml raise its own error for this node
+                del out[start:]
+                out.append(Slate2HTML().to_html([child]))
+                logger.warning(
+                    "The string slate2html engine failed on a %r node, "
+                    "serialized with lxml instead",
+                    child.get("type"),
+                )
+
+        if has_text:
+            # like lxml, text needs to be in an element
+            raise TypeError("Type 'str' cannot be serialized.")
+
+        return u"".join(out)
+
+    def iter_html(self, value):
+        """Generate the HTML of each top-level node of the value, as soon as
+        it is serialized
+
+        :param value:
+        """
+        for child in value:
+            yield self.to_html([child])
+
+    def write_html(self, value, fp):
+        """Write the HTML of the value to a file-like object, one top-level
+        node at a time
+
+        :param value:
+        :param fp: a file-like object open in text mode
+        """
+        for html in self.iter_html(value):
+            fp.write(html)
+
+
+ENGINES = {
+    "lxml": Slate2HTML,
+    "string": StringSlate2HTML,
+}
+
+
+def get_engine(name):
+    """Returns an instance of the named slate2html engine
+
+    :param name: one of the ENGINES keys
+    """
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError("Unknown slate2html engine: {}".format(name))
+
+
+def iter_slate_html(value, engine=SLATE2HTML_ENGINE):
+    """Generate the HTML of the value, one top-level node at a time
+
+    :param value:
+    :param engine: one of the ENGINES keys, see config.SLATE2HTML_ENGINE
+    """
+    return get_engine(engine).iter_html(value)
+
 
-def slate_to_html(value):
+def slate_to_html(value, engine=SLATE2HTML_ENGINE):
     """slate_to_html.
 
     :param value:
+    :param engine: one of the ENGINES keys, see config.SLATE2HTML_ENGINE
     """
-    convert = Slate2HTML()
+    convert = get_engine(engine)
     return convert.to_html(value)
@@ -0,0 +1,117 @@
+""" test cache module """
+# pylint: disable=import-error,no-name-in-module,too-few-public-methods,
+# pylint: disable=not-callable,no-self-use,unused-argument,invalid-name
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from eea.volto.slate.cache import (LRUCache, SQLiteCache, digest,
+                                   structural_hash)
+
+
+class TestDigest(unittest.TestCase):
+    """TestDigest."""
+
+    def test_bytes_parts(self):
+        """test_bytes_parts."""
+        expected = digest(u"html2slate", u"1.0", u"<p>é</p>")
+        data = u"<p>é</p>".encode("utf-8")
+        for part in (data, bytearray(data), memoryview(data)):
+            self.assertEqual(digest(u"html2slate", u"1.0", part), expected)
+        self.assertNotEqual(digest(u"html2slate", u"1.0", b"<p>e</p>"), expected)
+
+
+class TestStructuralHash(unittest.TestCase):
+    """TestStructuralHash."""
+
+    def test_equal_values(self):
+        """test_equal_values."""
+        value = {"type": "p", "children": [{"text": "Hi"}], "data": {"n": 1}}
+        text = '[{"type": "p", "children": [{"text": "Hi"}], "data": {"n": 1}}, '
+        parsed = json.loads(text + '{"type": "p", "data": {"n": 1}}]')[0]
+        self.assertEqual(structural_hash(value), structural_hash(parsed))
+
+        for other in [
+            {"type": "p", "children": [{"text": "Hi!"}], "data": {"n": 1}},
+            {"type": "p", "children": [{"text": "Hi"}], "data": {"n": True}},
+            {"type": "p", "children": [{"text": "Hi"}], "data": {"n": "1"}},
+        ]:
+            self.assertNotEqual(structural_hash(value), structural_hash(other))
+
+
+class TestLRUCache(unittest.TestCase):
+    """TestLRUCache."""
+
+    def test_lru_size_bound(self):
+        """test_lru_size_bound."""
+        cache = LRUCache(1000)
+        for i in range(100):
+            cache.set(str(i), "x" * 100)
+        self.assertTrue(cache.size <= 1000)
+        self.assertTrue(0 < len(cache) < 10)
+        self.assertEqual(cache.get("0"), None)
+        self.assertEqual(cache.get("99"), "x" * 100)
+
+        cache.set("big", "x" * 1000)
+        self.assertEqual(cache.get("big"), None)
+
+
+class TestSQLiteCache(unittest.TestCase):
+    """TestSQLiteCache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_persistent(self):
+        """test_persistent."""
+        cache = SQLiteCache(self.path, 10)
+        self.assertEqual(cache.get("a"), None)
+        cache.set("a", "value")
+        self.assertEqual(cache.get("a"), "value")
+
+        # another process opening the same file
+        self.assertEqual(SQLiteCache(self.path, 10).get("a"), "value")
+
+    def test_evicts_least_recently_used(self):
+        """test_evicts_least_recently_used."""
+        cache = SQLiteCache(self.path, 3)
+        for i, key in enumerate("abcde"):
+            cache.connection.execute(
+                "INSERT INTO cache VALUES (?, ?, ?)", (key, key, i)
+            )
+        cache.set("f", "f")
+        self.assertEqual(
+            [cache.get(k) for k in "abcdef"], [None, None, None, "d", "e", "f"]
+        )
+
+    def test_evicts_in_batches(self):
+        """The entries are counted every 10 writes, then evicted down to 90%"""
+        cache = SQLiteCache(self.path, 100)
+        for i in range(109):
+            cache.set(str(i), "value")
+        self.assertEqual(self.count(cache), 109)
+
+        cache.set("109", "value")
+        self.assertEqual(self.count(cache), 90)
+        self.assertEqual(cache.get("109"), "value")
+
+    def count(self, cache):
+        """Returns the number of cached entries
+
+        :param cache:
+        """
+        return cache.connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def test_errors_are_misses(self):
+        """test_errors_are_misses."""
+        cache = SQLiteCache(self.path, 3)
+        cache.connection.execute("DROP TABLE cache")
+        cache.set("a", "value")
+        self.assertEqual(cache.get("a"), None)
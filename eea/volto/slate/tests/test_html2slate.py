@@ -3,17 +3,24 @@
 
 import json
 import os
+import random
+import timeit
 import unittest
+import uuid
 
+from unittest import mock
 from pkg_resources import resource_filename
 
-from eea.volto.slate.html2slate import (convert_linebreaks_to_spaces,
+from eea.volto.slate import html2slate
+from eea.volto.slate.utils import json_loads
+from eea.volto.slate.html2slate import (HTML2Slate, collapse_whitespace,
+                                        convert_linebreaks_to_spaces,
                                         convert_tabs_to_spaces,
                                         fragments_fromstring,
                                         merge_adjacent_text_nodes,
                                         remove_space_before_after_endline,
                                         remove_space_follow_space,
-                                        text_to_slate)
+                                        text_to_slate, update_slate)
 
 
 def read_data(filename):
@@ -58,6 +65,21 @@ class TestTextUtilities(unittest.TestCase):
         text = convert_linebreaks_to_spaces(html)
         assert text == "<h1>   Hello <span> World!</span>   </h1>"
 
+    def test_collapse_whitespace(self):
+        html = "<h1>   Hello \n\t\t\t\t<span> World!</span>\t  </h1>"
+        text = collapse_whitespace(html)
+        assert text == "<h1> Hello <span> World!</span> </h1>"
+
+    def test_collapse_whitespace_matches_rules(self):
+        html = "a \r\n b\t\tc\xa0 \xa0d  \n\n e\t"
+        text = remove_space_follow_space(
+            convert_linebreaks_to_spaces(
+                convert_tabs_to_spaces(remove_space_before_after_endline(html))
+            ),
+            None,
+        )
+        assert collapse_whitespace(html) == text
+
     def test_remove_space_follow_space_nospace(self):
         text = remove_space_follow_space("World!", None)
         assert text == "World!"
@@ -280,6 +302,62 @@ class TestConvertHTML2Slate(unittest.TestCase):
             ],
         )
 
+    def test_collapse_each_node_once(self):
+        """Long runs of inline siblings are collapsed in linear time"""
+        html = "<p>{}</p>".format("<b> x</b>" * 2000)
+        with mock.patch.object(
+            html2slate, "collapse_whitespace", wraps=collapse_whitespace
+        ) as collapse:
+            res = text_to_slate(html)
+
+        # 2000 inline elements and the 2000 text nodes inside them
+        self.assertTrue(collapse.call_count <= 4000)
+        self.assertEqual(
+            res[0]["children"][1], {"type": "b", "children": [{"text": "x"}]}
+        )
+
+    def test_merge_text_nodes_scaling(self):
+        """merge_adjacent_text_nodes runs in linear time"""
+
+        def timing(size):
+            q = [{"text": "a"}, {"text": "b"}, {"type": "m"}] * (size // 3)
+            res = merge_adjacent_text_nodes(q)
+            self.assertEqual(len(res), (size // 3) * 2)
+            return min(
+                timeit.repeat(lambda: merge_adjacent_text_nodes(q), number=1, repeat=3)
+            )
+
+        small, large = timing(10000), timing(100000)
+
+        # linear is ~10x, quadratic would be ~100x
+        self.assertTrue(large < small * 30, (small, large))
+
+    def test_subclass_tag_handler(self):
+        """handle_tag_* methods of subclasses are dispatched"""
+
+        class Converter(HTML2Slate):
+            def handle_tag_span(self, node):
+                return {"type": "span", "children": self.deserialize_children(node)}
+
+        res = Converter().to_slate("<p>Hello <span>world</span></p>")
+        self.assertEqual(
+            res,
+            [
+                {
+                    "children": [
+                        {"text": "Hello "},
+                        {"children": [{"text": "world"}], "type": "span"},
+                        {"text": ""},
+                    ],
+                    "type": "p",
+                }
+            ],
+        )
+        self.assertEqual(
+            text_to_slate("<p>Hello <span>world</span></p>"),
+            [{"children": [{"text": "Hello world"}], "type": "p"}],
+        )
+
     def test_convert_case_simple_p(self):
         """test_convert_case_simple_p."""
         text = read_data("1.html")
@@ -400,3 +478,209 @@ class TestConvertHTML2Slate(unittest.TestCase):
             res,
             read_json("8.json"),
         )
+
+
+class TestIterativeHTML2Slate(unittest.TestCase):
+    """Test the explicit stack deserializer"""
+
+    maxDiff = None
+
+    def test_same_value_as_recursive(self):
+        """test_same_value_as_recursive."""
+        for filename in ["1.html", "2.html", "5.html", "6.html", "7.html", "8.html"]:
+            text = read_data(filename)
+            res = HTML2Slate(iterative=True).to_slate(text)
+            self.assertEqual(res, text_to_slate(text))
+
+    def test_deep_nesting(self):
+        """test_deep_nesting."""
+        depth = 3000
+        html = "<p>{}x{}</p>".format("<span><b>" * depth, "</b></span>" * depth)
+        res = HTML2Slate(iterative=True).to_slate(html)
+
+        node = res[0]
+        for _ in range(depth):
+            node = node["children"][1]
+            self.assertEqual(node["type"], "b")
+        self.assertEqual(node["children"], [{"text": "x"}])
+
+    def test_max_depth(self):
+        """test_max_depth."""
+        html = "<p><b><i>x</i></b></p>"
+        res = HTML2Slate(iterative=True, max_depth=3).to_slate(html)
+        self.assertEqual(res, text_to_slate(html))
+
+        with self.assertRaises(ValueError):
+            HTML2Slate(iterative=True, max_depth=2).to_slate(html)
+
+
+class TestFusedHTML2Slate(unittest.TestCase):
+    """Test normalizing during deserialization"""
+
+    maxDiff = None
+
+    def test_same_value_as_two_pass(self):
+        """test_same_value_as_two_pass."""
+        texts = [
+            read_data(filename)
+            for filename in ["1.html", "2.html", "5.html", "6.html", "7.html", "8.html"]
+        ]
+        texts.append("Hello <strong>world</strong><p>mixed</p> content")
+        for text in texts:
+            expected = text_to_slate(text)
+            for iterative in (False, True):
+                converter = HTML2Slate(iterative=iterative, fused=True)
+                self.assertEqual(converter.to_slate(text), expected)
+                self.assertEqual(list(converter.iter_slate(text)), expected)
+
+
+class TestStreamingHTML2Slate(unittest.TestCase):
+    """Test the iter_slate generator"""
+
+    maxDiff = None
+
+    def test_same_value_as_to_slate(self):
+        """test_same_value_as_to_slate."""
+        for filename in ["1.html", "2.html", "5.html", "6.html", "7.html", "8.html"]:
+            text = read_data(filename)
+            res = list(HTML2Slate().iter_slate(text))
+            self.assertEqual(res, text_to_slate(text))
+
+    def test_leading_inline_content(self):
+        """test_leading_inline_content."""
+        text = "Hello <strong>world</strong><p>mixed</p> content"
+        res = list(HTML2Slate().iter_slate(text))
+        self.assertEqual(res, text_to_slate(text))
+        self.assertEqual(len(res), 1)
+
+    def test_many_inline_fragments(self):
+        """Each top-level inline fragment only looks back at the previous one"""
+        for fragment in ["<b> x</b>", " y <i>z </i>"]:
+            text = fragment * 3000
+            res = list(HTML2Slate().iter_slate(text))
+            self.assertEqual(res, HTML2Slate().to_slate(text))
+
+    def test_yields_incrementally(self):
+        """test_yields_incrementally."""
+        nodes = HTML2Slate().iter_slate("<p>Hello</p><p>world</p>")
+        self.assertEqual(next(nodes), {"type": "p", "children": [{"text": "Hello"}]})
+        self.assertEqual(next(nodes), {"type": "p", "children": [{"text": "world"}]})
+        self.assertEqual(list(nodes), [])
+
+
+FRAGMENTS = [
+    "<p>Paragraph {0} with <b>bold</b> text </p>",
+    "<h2> Title {0}</h2>",
+    "<ul><li>one {0}</li>\n  <li> two </li></ul>",
+    "\n  ",
+    " text {0} ",
+    "<b> inline {0}</b>",
+    "<div><p>in div {0}</p> tail </div>",
+    "<!-- comment {0} -->",
+    "<br>",
+    "<a href='/page-{0}'>link</a> ",
+    "<p data-slate-data='{{\"type\": \"x\", \"data\": {{\"n\": {0}}}}}'>x</p>",
+    "<span data-slate-data='{{\"type\": \"y\", \"data\": {{}}}}'> y {0}</span>",
+]
+
+
+class TestIncrementalHTML2Slate(unittest.TestCase):
+    """Test update_slate"""
+
+    maxDiff = None
+
+    def random_fragments(self, rng, count):
+        """random_fragments.
+
+        :param rng: a random.Random
+        :param count:
+        """
+        return [
+            rng.choice(FRAGMENTS).format(rng.randint(0, 9)) for _ in range(count)
+        ]
+
+    def test_random_edits(self):
+        """test_random_edits."""
+        rng = random.Random(18)
+        converters = [
+            HTML2Slate(),
+            HTML2Slate(iterative=True),
+            HTML2Slate(fused=True),
+            HTML2Slate(parser="lxml"),
+        ]
+        for _ in range(300):
+            fragments = self.random_fragments(rng, rng.randint(0, 12))
+            old_text = "".join(fragments)
+            for _ in range(rng.randint(1, 3)):
+                i = rng.randint(0, len(fragments))
+                edit = rng.choice(["insert", "replace", "delete"])
+                if edit != "insert" and i < len(fragments):
+                    del fragments[i]
+                if edit != "delete":
+                    fragments[i:i] = self.random_fragments(rng, rng.randint(1, 2))
+            text = "".join(fragments)
+
+            for converter in converters:
+                old_value = converter.to_slate(old_text)
+                res = converter.update_slate(old_text, old_value, text)
+                self.assertEqual(res, converter.to_slate(text), (old_text, text))
+
+    def test_reuses_unchanged_elements(self):
+        """test_reuses_unchanged_elements."""
+        old_text = "<p>one</p>\n<p>two</p>\n<h2>three</h2>\n<p>four</p>"
+        old_value = text_to_slate(old_text)
+        text = old_text.replace("three", "3")
+
+        res = update_slate(old_text, old_value, text)
+        self.assertEqual(res, text_to_slate(text))
+        self.assertTrue(res[0] is old_value[0] and res[1] is old_value[1])
+        self.assertTrue(res[3] is old_value[3])
+
+        tags = []
+
+        class Converter(HTML2Slate):
+            """Converter."""
+
+            def deserialize(self, node):
+                tags.append(node.tag)
+                return super(Converter, self).deserialize(node)
+
+        Converter().update_slate(old_text, old_value, text)
+        self.assertEqual(tags.count("h2"), 2)  # the old and the new one
+        self.assertFalse("p" in tags)
+
+    def test_stale_old_value(self):
+        """test_stale_old_value."""
+        old_value = text_to_slate("<p>one</p>")
+        text = "<p>one</p><p>two</p>"
+        res = update_slate("<p>one</p><p>three</p>", old_value, text)
+        self.assertEqual(res, text_to_slate(text))
+
+
+class TestSlateData(unittest.TestCase):
+    """Test the decoding of data-slate-data attributes"""
+
+    def test_repeated_payloads(self):
+        """test_repeated_payloads."""
+        data = json.dumps({"type": "footnote", "data": {"uid": str(uuid.uuid4())}})
+        text = "<p>{}</p>".format(
+            "<span data-slate-data='{}'>*</span>".format(data) * 3
+        )
+        with mock.patch(
+            "eea.volto.slate.utils.json_loads", wraps=json_loads
+        ) as decode:
+            value = text_to_slate(text)
+        self.assertEqual(decode.call_count, 1)
+
+        footnotes = [child for child in value[0]["children"] if "type" in child]
+        self.assertEqual(len(footnotes), 3)
+        footnotes[0]["data"]["uid"] = "changed"
+        self.assertNotEqual(footnotes[1]["data"]["uid"], "changed")
+
+    def test_json_loads(self):
+        """test_json_loads."""
+        self.assertEqual(json_loads('{"a": [1, 2.5, null]}'), {"a": [1, 2.5, None]})
+        big = json_loads('{"big": 100000000000000000000000}')["big"]
+        self.assertEqual((big, type(big)), (10 ** 23, int))
+        with self.assertRaises(ValueError):
+            json_loads("{")
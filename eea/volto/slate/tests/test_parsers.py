@@ -0,0 +1,147 @@
+""" test parsers module """
+# pylint: disable=import-error,no-name-in-module,too-few-public-methods,
+# pylint: disable=not-callable,no-self-use,unused-argument,invalid-name
+# -*- coding: utf-8 -*-
+import codecs
+import unittest
+
+from eea.volto.slate.benchmark import benchmark_parsers, fastest_parser
+from eea.volto.slate.html2slate import HTML2Slate, text_to_slate
+from eea.volto.slate.parsers import PARSERS, detect_encoding, get_parser
+from eea.volto.slate.tests.test_html2slate import read_data
+
+CORPUS = ["1.html", "2.html", "5.html", "6.html", "7.html", "8.html"]
+
+
+class TestLxmlParser(unittest.TestCase):
+    """TestLxmlParser."""
+
+    maxDiff = None
+
+    def test_node_api(self):
+        """test_node_api."""
+        fragments = get_parser("lxml").fragments_fromstring(
+            "<p class='first'>Hello <br/>world<!-- c --></p> tail"
+        )
+        p, tail = fragments
+        hello, br, world, comment = p.child_nodes
+
+        self.assertEqual((p.tag, p.type, p["class"]), ("p", 1, "first"))
+        self.assertTrue("class" in p.attrs)
+        self.assertEqual(p.text, "Hello world")
+        self.assertEqual((hello.tag, hello.type, hello.text), ("#text", 3, "Hello "))
+        self.assertTrue(hello.prev is None and hello.next is br and br.prev is hello)
+        self.assertTrue(br.parent is p and world.next is comment)
+        self.assertEqual(comment.type, 8)
+        self.assertEqual(tail.text, " tail")
+        self.assertEqual(p.parent.tag, "body")
+
+    def test_same_value_as_resiliparse(self):
+        """test_same_value_as_resiliparse."""
+        converter = HTML2Slate(parser="lxml")
+        for filename in CORPUS:
+            text = read_data(filename)
+            self.assertEqual(converter.to_slate(text), text_to_slate(text))
+
+        for text in ["", "Hello world", "  <p> x </p> <p>y</p> "]:
+            self.assertEqual(converter.to_slate(text), text_to_slate(text))
+
+    def test_full_document(self):
+        """Only the body of full documents is converted"""
+        converter = HTML2Slate(parser="lxml")
+        for text in [
+            "<html><head><title>T</title><style>p {}</style></head>"
+            "<body><p>x</p></body></html>",
+            "<!DOCTYPE html>\n<html><head><title>T</title></head><p>x</p></html>",
+            "<p>a</p></body><p>b</p>",
+            "<p>a</p></html><p>b</p>",
+            "<html><body><p>a</p></body></html><p>b</p>",
+        ]:
+            self.assertEqual(converter.to_slate(text), text_to_slate(text))
+
+    def test_deep_nesting(self):
+        """Content nested deeper than libxml2's default limit isn't lost"""
+        for depth in (300, 1000):
+            text = "<p>{}x{}</p><p>after</p><h2>more</h2>".format(
+                "<span>" * depth, "</span>" * depth
+            )
+            expected = HTML2Slate(iterative=True).to_slate(text)
+            self.assertEqual(len(expected), 3)
+            converter = HTML2Slate(iterative=True, parser="lxml")
+            self.assertEqual(converter.to_slate(text), expected)
+            self.assertEqual(converter.to_slate(text.encode("utf-8")), expected)
+
+    def test_unknown_parser(self):
+        """test_unknown_parser."""
+        with self.assertRaises(ValueError):
+            HTML2Slate(parser="unknown")
+
+
+class TestBytesInput(unittest.TestCase):
+    """TestBytesInput."""
+
+    maxDiff = None
+
+    def test_same_value_as_text(self):
+        """test_same_value_as_text."""
+        for name in sorted(PARSERS):
+            converter = HTML2Slate(parser=name)
+            for filename in CORPUS:
+                text = read_data(filename)
+                data = text.encode("utf-8")
+                value = converter.to_slate(text)
+                self.assertEqual(converter.to_slate(data), value)
+                self.assertEqual(converter.to_slate(memoryview(data)), value)
+                self.assertEqual(list(converter.iter_slate(data)), value)
+
+    def test_full_document(self):
+        """Only the body of full documents is converted"""
+        text = (
+            u"<html><head><title>T</title><style>p {}</style></head>"
+            u"<body><p>café</p></body></html><p>after</p>"
+        )
+        expected = text_to_slate(text)
+        converter = HTML2Slate(parser="lxml")
+        for encoding in ("utf-8", "utf-16-le", "latin-1"):
+            data = text.encode(encoding)
+            self.assertEqual(converter.to_slate(data, encoding), expected)
+            self.assertEqual(converter.to_slate(memoryview(data), encoding), expected)
+
+    def test_encodings(self):
+        """test_encodings."""
+        expected = [{"type": "p", "children": [{"text": "café"}]}]
+        meta = '<meta charset="iso-8859-1"><p>café</p>'.encode("latin-1")
+        for name in sorted(PARSERS):
+            converter = HTML2Slate(parser=name)
+            self.assertEqual(converter.to_slate(meta), expected)
+            data = "<p>café</p>".encode("cp1252")
+            self.assertEqual(converter.to_slate(data, "cp1252"), expected)
+            data = codecs.BOM_UTF8 + "<p>café</p>".encode("utf-8")
+            self.assertEqual(converter.to_slate(data), expected)
+            data = "<p>café</p>".encode("utf-16")
+            self.assertEqual(converter.to_slate(data), expected)
+            self.assertEqual(converter.to_slate(b""), [])
+
+    def test_detect_encoding(self):
+        """test_detect_encoding."""
+        self.assertEqual(detect_encoding(b"<p>x</p>"), ("utf-8", b""))
+        self.assertEqual(
+            detect_encoding(b'<meta charset="Latin-1">'), ("iso8859-1", b"")
+        )
+        self.assertEqual(detect_encoding(b'<meta charset="utf-16">'), ("utf-8", b""))
+        self.assertEqual(detect_encoding(b'<meta charset="bogus">'), ("utf-8", b""))
+        self.assertEqual(
+            detect_encoding(codecs.BOM_UTF16_LE + b"<\x00"),
+            ("utf-16-le", codecs.BOM_UTF16_LE),
+        )
+
+
+class TestBenchmark(unittest.TestCase):
+    """TestBenchmark."""
+
+    def test_benchmark(self):
+        """test_benchmark."""
+        texts = [read_data(filename) for filename in CORPUS]
+        timings = benchmark_parsers(texts, repeat=1)
+        self.assertEqual(sorted(timings), sorted(PARSERS))
+        self.assertTrue(fastest_parser(texts, repeat=1) in PARSERS)
@@ -3,15 +3,23 @@
 # pylint: disable=not-callable,no-self-use,unused-argument,invalid-name
 # -*- coding: utf-8 -*-
 
+import io
 import json
 import os
 import re
 import unittest
+import uuid
+from unittest import mock
 
 from pkg_resources import resource_filename
 
 # from eea.volto.slate.html2slate import text_to_slate
-from eea.volto.slate.slate2html import slate_to_html
+from eea.volto.slate.cache import canonical_json
+from eea.volto.slate.slate2html import (ENGINES, Slate2HTML, StringSlate2HTML,
+                                        get_engine, iter_slate_html,
+                                        slate_to_html)
+
+DATA = ["1.json", "2.json", "5.json", "6.json", "7.json", "8.json"]
 
 
 def read_data(filename):
@@ -216,3 +224,230 @@ class TestConvertSlate2HTML(unittest.TestCase):
     #    self.assertTrue("<span data-slate-data=" in html)
 
     #    self.assertEqual(text_to_slate(html), slate)
+
+
+class TestStringSlate2HTML(unittest.TestCase):
+    """TestStringSlate2HTML."""
+
+    maxDiff = None
+
+    def assertSameHTML(self, value):
+        """assertSameHTML.
+
+        :param value:
+        """
+        self.assertEqual(
+            slate_to_html(value, engine="string"),
+            slate_to_html(value, engine="lxml"),
+        )
+
+    def test_same_html(self):
+        """test_same_html."""
+        for filename in DATA:
+            self.assertSameHTML(read_json(filename))
+
+    def test_escaping(self):
+        """test_escaping."""
+        for text in [u"a & <b> \"q\" 'x' é€😀", u"a\nb\r\tc", u"&{x}&amp;", u""]:
+            link = {"link": {"internal": {"internal_link": [{"@id": text}]}}}
+            self.assertSameHTML(
+                [
+                    {"type": "p", "children": [{"text": text}]},
+                    {"type": "a", "children": [{"text": text}], "data": link},
+                    {"type": "x", "children": [], "data": {"k": text}},
+                ]
+            )
+        for href in [u" /a b?q=é&{x}", u'a"b', u"a\"b'c", u"%20<>"]:
+            link = {"link": {"internal": {"internal_link": [{"@id": href}]}}}
+            self.assertSameHTML([{"type": "a", "children": [], "data": link}])
+
+    def test_empty_elements(self):
+        """test_empty_elements."""
+        self.assertSameHTML(
+            [
+                {"type": "ul", "children": [{"type": "li", "children": []}]},
+                {"type": "li", "children": [{"text": ""}]},
+                {"type": "p", "children": []},
+            ]
+        )
+
+    def test_errors(self):
+        """test_errors."""
+        for value in [
+            [{"text": "top level"}],
+            [{"type": "p", "children": [{"text": u"\x00"}]}],
+            [{"type": "unknown", "children": []}],
+        ]:
+            with self.assertRaises(Exception) as lxml_error:
+                slate_to_html(value, engine="lxml")
+            with self.assertRaises(Exception) as string_error:
+                slate_to_html(value, engine="string")
+            self.assertEqual(
+                type(string_error.exception), type(lxml_error.exception)
+            )
+
+        with self.assertRaises(ValueError):
+            slate_to_html([], engine="unknown")
+
+    def test_lxml_fallback_per_node(self):
+        """Only the node that fails is serialized again with lxml"""
+        value = [
+            {"type": "p", "children": [{"text": "one"}]},
+            {"type": "h2", "children": [{"text": "two"}]},
+            {"type": "p", "children": [{"text": "three"}]},
+        ]
+        serialize = StringSlate2HTML.serialize
+
+        def failing_serialize(self, element, out):
+            """Fails on h2 elements, after writing some HTML"""
+            out.append("<partial>")
+            if element["type"] == "h2":
+                raise ValueError("h2")
+            return serialize(self, element, out)
+
+        with mock.patch.object(
+            StringSlate2HTML, "serialize", failing_serialize
+        ), mock.patch("eea.volto.slate.slate2html.Slate2HTML.to_html") as to_html:
+            to_html.return_value = "<h2>lxml</h2>"
+            html = StringSlate2HTML().to_html(value)
+
+        to_html.assert_called_once_with([value[1]])
+        self.assertEqual(
+            html, "<partial><p>one</p><h2>lxml</h2><partial><p>three</p>"
+        )
+
+
+class TestStreamingSlate2HTML(unittest.TestCase):
+    """TestStreamingSlate2HTML."""
+
+    maxDiff = None
+
+    def test_write_html(self):
+        """test_write_html."""
+        for engine in sorted(ENGINES):
+            for filename in DATA:
+                value = read_json(filename)
+                fp = io.StringIO()
+                get_engine(engine).write_html(value, fp)
+                self.assertEqual(fp.getvalue(), slate_to_html(value, engine))
+
+    def test_iter_html(self):
+        """test_iter_html."""
+        value = [
+            {"type": "p", "children": [{"text": "Hello"}]},
+            {"type": "h1", "children": [{"text": "world"}]},
+            {"text": "top level"},
+        ]
+        for engine in sorted(ENGINES):
+            chunks = iter_slate_html(value, engine)
+            self.assertEqual(next(chunks), "<p>Hello</p>")
+            self.assertEqual(next(chunks), "<h1>world</h1>")
+            with self.assertRaises(TypeError):
+                next(chunks)
+
+
+def nested_list(depth):
+    """A slate value of ul and li elements nested depth times
+
+    :param depth:
+    """
+    value = {"text": "deep"}
+    for i in range(depth):
+        value = {"type": "ul" if i % 2 else "li", "children": [value]}
+    return [value]
+
+
+class TestIterativeSlate2HTML(unittest.TestCase):
+    """TestIterativeSlate2HTML."""
+
+    maxDiff = None
+
+    def test_same_html(self):
+        """test_same_html."""
+        convert = Slate2HTML(iterative=True)
+        for filename in DATA:
+            value = read_json(filename)
+            self.assertEqual(convert.to_html(value), slate_to_html(value, "lxml"))
+
+    def test_deep_nesting(self):
+        """test_deep_nesting."""
+        value = nested_list(3000)
+        html = Slate2HTML(iterative=True).to_html(value)
+        self.assertTrue(html.startswith("<ul><li><ul>"))
+        self.assertEqual(html.count("</li>"), 1500)
+        self.assertEqual(StringSlate2HTML().to_html(value), html)
+
+    def test_max_depth(self):
+        """test_max_depth."""
+        with self.assertRaises(ValueError):
+            Slate2HTML(iterative=True, max_depth=100).to_html(nested_list(300))
+
+    def test_pipe_through_handler(self):
+        """test_pipe_through_handler."""
+
+        class Converter(Slate2HTML):
+            """Converter."""
+
+            def handle_tag_s(self, element):
+                """handle_tag_s.
+
+                :param element:
+                """
+                return self.serialize_children(element)
+
+        value = [
+            {
+                "type": "p",
+                "children": [
+                    {"text": "a "},
+                    {
+                        "type": "s",
+                        "children": [
+                            {"text": "b "},
+                            {"type": "i", "children": [{"text": "c"}]},
+                        ],
+                    },
+                    {"text": " d"},
+                ],
+            }
+        ]
+        html = "<p>a b <i>c</i> d</p>"
+        self.assertEqual(Converter().to_html(value), html)
+        self.assertEqual(Converter(iterative=True).to_html(value), html)
+
+
+class TestSlateData(unittest.TestCase):
+    """TestSlateData."""
+
+    maxDiff = None
+
+    def test_canonical_compact_json(self):
+        """test_canonical_compact_json."""
+        value = [
+            {
+                "type": "footnote",
+                "data": {"uid": "abc", "footnote": u"é"},
+                "children": [{"text": "1"}],
+            }
+        ]
+        html = (
+            "<span data-slate-data='{\"data\":{\"footnote\":\"\\u00e9\","
+            "\"uid\":\"abc\"},\"type\":\"footnote\"}'>1</span>"
+        )
+        for engine in sorted(ENGINES):
+            self.assertEqual(slate_to_html(value, engine), html)
+
+    def test_repeated_payloads(self):
+        """test_repeated_payloads."""
+        footnote = {
+            "type": "footnote",
+            "data": {"uid": str(uuid.uuid4())},
+            "children": [{"text": "*"}],
+        }
+        value = [{"type": "p", "children": [footnote] * 100}]
+        with mock.patch(
+            "eea.volto.slate.utils.canonical_json", wraps=canonical_json
+        ) as encode:
+            html = slate_to_html(value)
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(html.count("data-slate-data"), 100)
@@ -4,19 +4,47 @@
 # -*- coding: utf-8 -*-
 import json
 import unittest
+from unittest import mock
 
 from zope.component import getMultiAdapter, queryUtility
 import transaction
+from plone import api
 from plone.app.testing import TEST_USER_ID, setRoles
 from plone.dexterity.interfaces import IDexterityFTI
 from plone.dexterity.utils import createContentInContainer, iterSchemata
 from plone.restapi.interfaces import IDeserializeFromJson, IFieldSerializer
-# from plone.uuid.interfaces import IUUID
+from plone.restapi.serializer.blocks import uid_to_url
+from plone.uuid.interfaces import IUUID
 from z3c.form.interfaces import IDataManager
 
+from eea.volto.slate.block import (LINK_PATHS, UID_PATHS,
+                                   SlateBlockDeserializer,
+                                   SlateBlockDeserializerBase,
+                                   SlateBlockSerializer)
+from eea.volto.slate.upgrades.evolve11 import index_slate_links
 from eea.volto.slate.tests.base import FUNCTIONAL_TESTING
 
 
+def link_node(path):
+    """Returns a slate link node to an internal path
+
+    :param path:
+    """
+    return {
+        "type": "a",
+        "children": [{"text": "link"}],
+        "data": {"link": {"internal": {"internal_link": [{"@id": path}]}}},
+    }
+
+
+def link_path(node):
+    """Returns the internal path of a slate link node
+
+    :param node:
+    """
+    return node["data"]["link"]["internal"]["internal_link"][0]["@id"]
+
+
 class TestBlockTransformers(unittest.TestCase):
     """TestBlockTransformers."""
 
@@ -165,6 +193,205 @@ class TestBlockTransformers(unittest.TestCase):
 
     #    self.assertTrue(resolve_link == "/front-page")
 
+    def test_serializer_batch_resolveuid(self):
+        """All the resolveuid links of a block are resolved with one query"""
+        uid = IUUID(self.doc)
+        nodes = [
+            link_node("../resolveuid/{}".format(uid)),
+            link_node("../resolveuid/{}/@@images/image".format(uid)),
+            link_node("../resolveuid/missing"),
+            link_node("{}/doc".format(self.portal_url)),
+            link_node(""),
+        ]
+        serializer = SlateBlockSerializer(self.doc, self.request)
+        catalog = self.portal.portal_catalog
+        with mock.patch.object(
+            type(catalog),
+            "unrestrictedSearchResults",
+            autospec=True,
+            side_effect=type(catalog).unrestrictedSearchResults,
+        ) as search:
+            for node in nodes:
+                serializer.handle_a(node)
+            serializer.resolve_links(serializer.links)
+
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(
+            [link_path(node) for node in nodes],
+            ["/doc", "/doc/@@images/image", "../resolveuid/missing", "/doc", ""],
+        )
+
+    def test_serializer_same_as_uid_to_url(self):
+        """Links are serialized like plone.restapi's uid_to_url does"""
+        file_ = createContentInContainer(self.portal, u"File", id=u"file")
+        link = createContentInContainer(
+            self.portal, u"Link", id=u"link", remoteUrl=u"http://example.com"
+        )
+        paths = []
+        for obj in (self.doc, file_, link):
+            paths.append("../resolveuid/{}".format(IUUID(obj)))
+            paths.append("../resolveuid/{}/view".format(IUUID(obj)))
+        nodes = [link_node(path) for path in paths]
+
+        serializer = SlateBlockSerializer(self.doc, self.request)
+        for node in nodes:
+            serializer.handle_a(node)
+        serializer.resolve_links(serializer.links)
+
+        self.assertEqual(
+            [link_path(node) for node in nodes],
+            [uid_to_url(path).replace(self.portal_url, "") for path in paths],
+        )
+
+    def test_deserializer_batch_path2uid(self):
+        """All the link paths of a block are resolved with one query"""
+        uid = IUUID(self.doc)
+        nodes = [
+            link_node("/doc"),
+            link_node("{}/doc".format(self.portal_url)),
+            link_node("/missing"),
+            link_node(""),
+        ]
+        deserializer = SlateBlockDeserializer(self.doc, self.request)
+        catalog = self.portal.portal_catalog
+        with mock.patch.object(
+            type(catalog),
+            "unrestrictedSearchResults",
+            autospec=True,
+            side_effect=type(catalog).unrestrictedSearchResults,
+        ) as search:
+            for node in nodes:
+                deserializer.handle_a(node)
+            deserializer.resolve_links(deserializer.links)
+
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(
+            [link_path(node) for node in nodes],
+            [
+                "../resolveuid/{}".format(uid),
+                "../resolveuid/{}".format(uid),
+                "/missing",
+                "",
+            ],
+        )
+
+    def test_serializer_uid_path_cache(self):
+        """Resolved UIDs are cached until content is moved"""
+        UID_PATHS.clear()
+        uid = IUUID(self.doc)
+        catalog = self.portal.portal_catalog
+
+        def resolve():
+            """Returns the path of a resolveuid link to the document"""
+            node = link_node("../resolveuid/{}".format(uid))
+            serializer = SlateBlockSerializer(self.doc, self.request)
+            serializer.handle_a(node)
+            serializer.resolve_links(serializer.links)
+            return link_path(node)
+
+        with mock.patch.object(
+            type(catalog),
+            "unrestrictedSearchResults",
+            autospec=True,
+            side_effect=type(catalog).unrestrictedSearchResults,
+        ) as search:
+            self.assertEqual(resolve(), "/doc")
+            self.assertEqual(resolve(), "/doc")
+            self.assertEqual(search.call_count, 1)
+
+            api.content.rename(obj=self.doc, new_id="renamed")
+            self.assertEqual(resolve(), "/renamed")
+            self.assertEqual(search.call_count, 2)
+
+    def test_serializer_request_memo(self):
+        """Links are resolved once per request, whatever the block"""
+        uid = IUUID(self.doc)
+        catalog = self.portal.portal_catalog
+        nodes = [link_node("../resolveuid/{}".format(uid)) for _ in range(3)]
+
+        with mock.patch.object(
+            type(catalog),
+            "unrestrictedSearchResults",
+            autospec=True,
+            side_effect=type(catalog).unrestrictedSearchResults,
+        ) as search:
+            for node in nodes:
+                UID_PATHS.clear()
+                serializer = SlateBlockSerializer(self.doc, self.request)
+                serializer.handle_a(node)
+                serializer.resolve_links(serializer.links)
+
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual([link_path(node) for node in nodes], ["/doc"] * 3)
+
+    def test_transform_block(self):
+        """The transformers rewrite the links of the block value"""
+        block = {
+            "@type": "slate",
+            "value": [
+                {
+                    "type": "p",
+                    "children": [
+                        {"text": "a "},
+                        {"type": "strong", "children": [link_node("/doc")]},
+                    ],
+                }
+            ],
+        }
+        link = block["value"][0]["children"][1]["children"][0]
+
+        block = SlateBlockDeserializer(self.doc, self.request)(block)
+        self.assertEqual(link_path(link), "../resolveuid/{}".format(IUUID(self.doc)))
+        self.assertEqual(block[LINK_PATHS], [[0, 1, 0]])
+        block = SlateBlockSerializer(self.doc, self.request)(block)
+        self.assertEqual(link_path(link), "/doc")
+        self.assertFalse(LINK_PATHS in block)
+
+    def test_serializer_link_paths(self):
+        """The serializer only visits the indexed link nodes"""
+        uid = IUUID(self.doc)
+        value = [
+            {"type": "p", "children": [link_node("../resolveuid/{}".format(uid))]},
+            {"type": "p", "children": [link_node("../resolveuid/{}".format(uid))]},
+        ]
+        serializer = SlateBlockSerializer(self.doc, self.request)
+
+        block = serializer({"@type": "slate", "value": value, LINK_PATHS: [[1, 0]]})
+        self.assertEqual(
+            [link_path(node["children"][0]) for node in block["value"]],
+            ["../resolveuid/{}".format(uid), "/doc"],
+        )
+
+        # stale paths fall back to a walk of the whole value
+        block = serializer({"@type": "slate", "value": value, LINK_PATHS: [[0, 1]]})
+        self.assertEqual(
+            [link_path(node["children"][0]) for node in block["value"]],
+            ["/doc", "/doc"],
+        )
+
+    def test_upgrade_link_paths(self):
+        """The upgrade step indexes the links of the existing blocks"""
+        self.doc.blocks = {
+            "a": {"@type": "slate", "value": [link_node("/doc")]},
+            "b": {"@type": "slate"},
+            "c": {"@type": "title"},
+        }
+        self.doc.reindexObject()
+        index_slate_links(self.portal.portal_setup)
+
+        self.assertEqual(self.doc.blocks["a"][LINK_PATHS], [[0]])
+        self.assertEqual(self.doc.blocks["b"][LINK_PATHS], [])
+        self.assertFalse(LINK_PATHS in self.doc.blocks["c"])
+
+    def test_upgrade_link_paths_disabled(self):
+        """No paths are stored if the transforms are disabled"""
+        self.doc.blocks = {"a": {"@type": "slate", "value": [link_node("/doc")]}}
+        self.doc.reindexObject()
+        with mock.patch.object(SlateBlockDeserializerBase, "disabled", "1"):
+            index_slate_links(self.portal.portal_setup)
+
+        self.assertFalse(LINK_PATHS in self.doc.blocks["a"])
+
     def test_bogus(self):
         """ Bogus test to avoid deleting the entire module """
 
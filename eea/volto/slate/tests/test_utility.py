@@ -0,0 +1,151 @@
+""" test utility module """
+# pylint: disable=import-error,no-name-in-module,too-few-public-methods,
+# pylint: disable=not-callable,no-self-use,unused-argument,invalid-name
+# -*- coding: utf-8 -*-
+import json
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+from eea.volto.slate.interfaces import ConversionError
+from eea.volto.slate.tests.test_slate2html import nested_list
+from eea.volto.slate.utility import SlateConverter
+
+
+class Text(str):
+    """A str subclass"""
+
+
+class TestBatchConversion(unittest.TestCase):
+    """TestBatchConversion."""
+
+    def setUp(self):
+        self.converter = SlateConverter()
+        self.texts = ["<p>Hello {}</p>".format(i) for i in range(20)]
+        self.values = [
+            [{"type": "p", "children": [{"text": "Hello {}".format(i)}]}]
+            for i in range(20)
+        ]
+
+    def test_html2slate_many_in_process(self):
+        """test_html2slate_many_in_process."""
+        res = self.converter.html2slate_many(self.texts)
+        self.assertEqual(res, self.values)
+
+    def test_html2slate_many_pool(self):
+        """test_html2slate_many_pool."""
+        res = self.converter.html2slate_many(self.texts, processes=2, threshold=0)
+        self.assertEqual(res, self.values)
+
+    def test_slate2html_many_pool(self):
+        """test_slate2html_many_pool."""
+        res = self.converter.slate2html_many(self.values, processes=2, threshold=0)
+        self.assertEqual(res, self.texts)
+
+    def test_errors_per_item(self):
+        """test_errors_per_item."""
+        values = [self.values[0], [{"type": "unknown"}], self.values[1]]
+        for threshold in (0, 100):
+            res = self.converter.slate2html_many(
+                values, processes=2, threshold=threshold
+            )
+            self.assertEqual(res[0], self.texts[0])
+            self.assertTrue(isinstance(res[1], ConversionError))
+            self.assertEqual(res[2], self.texts[1])
+
+
+class TestConversionCache(unittest.TestCase):
+    """TestConversionCache."""
+
+    def test_html2slate_cached_copy(self):
+        """test_html2slate_cached_copy."""
+        converter = SlateConverter()
+        value = converter.html2slate("<p>Hello world</p>")
+        value[0]["children"][0]["text"] = "changed"
+
+        res = converter.html2slate("<p>Hello world</p>")
+        self.assertEqual(res, [{"type": "p", "children": [{"text": "Hello world"}]}])
+        res[0]["type"] = "h1"
+        self.assertEqual(converter.html2slate("<p>Hello world</p>")[0]["type"], "p")
+        self.assertEqual((converter.cache.hits, converter.cache.misses), (2, 1))
+
+    def test_html2slate_bytes(self):
+        """test_html2slate_bytes."""
+        converter = SlateConverter()
+        text = u"<p>Hello wörld</p>"
+        expected = converter.html2slate(text)
+        for data in (text.encode("utf-8"), memoryview(text.encode("utf-8"))):
+            self.assertEqual(converter.html2slate(data), expected)
+
+        # bytes in another encoding don't share the key of their UTF-8 text
+        data = b'<meta charset="latin-1"><p>Hello w\xc3\xb6rld</p>'
+        converter.html2slate(data.decode("utf-8"))
+        self.assertEqual(
+            converter.html2slate(data), SlateConverter(cache_size=0).html2slate(data)
+        )
+        self.assertNotEqual(
+            converter.html2slate(data), converter.html2slate(data.decode("utf-8"))
+        )
+
+    def test_html2slate_parser_key(self):
+        """Each parser backend has its own cache keys"""
+        converter = SlateConverter()
+        converter.html2slate("<p>Hello</p>")
+        with mock.patch("eea.volto.slate.utility.HTML_PARSER", "lxml"):
+            converter.html2slate("<p>Hello</p>")
+        self.assertEqual((converter.cache.hits, converter.cache.misses), (0, 2))
+
+    def test_slate2html_structural_key(self):
+        """test_slate2html_structural_key."""
+        converter = SlateConverter()
+        html = converter.slate2html([{"type": "p", "children": [{"text": "Hi"}]}])
+        self.assertEqual(html, "<p>Hi</p>")
+        value = json.loads('[{"type": "p", "children": [{"text": "Hi"}]}]')
+        self.assertEqual(converter.slate2html(value), "<p>Hi</p>")
+        self.assertEqual((converter.cache.hits, converter.cache.misses), (1, 1))
+
+    def test_slate2html_per_node(self):
+        """test_slate2html_per_node."""
+        converter = SlateConverter()
+        value = [
+            {"type": "p", "children": [{"text": "Paragraph {}".format(i)}]}
+            for i in range(3)
+        ]
+        converter.slate2html(value)
+        value[1]["children"][0]["text"] = "Changed"
+        html = converter.slate2html(value)
+        self.assertEqual(
+            html, "<p>Paragraph 0</p><p>Changed</p><p>Paragraph 2</p>"
+        )
+        self.assertEqual((converter.cache.hits, converter.cache.misses), (2, 4))
+
+    def test_slate2html_not_marshalable(self):
+        """Nodes without a structural hash are converted without the cache"""
+        value = [
+            OrderedDict([("type", "p"), ("children", [{"text": "ordered"}])]),
+            {"type": "p", "children": [{"text": Text("subclass")}]},
+        ]
+        # too deep for the recursive lxml engine
+        for engine, value in (("lxml", value), ("string", value + nested_list(1500))):
+            converter = SlateConverter(engine=engine)
+            expected = SlateConverter(cache_size=0, engine=engine).slate2html(value)
+            self.assertEqual(converter.slate2html(value), expected)
+            self.assertEqual(len(converter.cache), 0)
+
+    def test_disabled(self):
+        """test_disabled."""
+        converter = SlateConverter(cache_size=0)
+        self.assertEqual(converter.slate2html([]), "")
+        self.assertEqual(converter.cache, None)
+
+    def test_engine(self):
+        """test_engine."""
+        value = [{"type": "p", "children": [{"text": u"Hi & é"}]}]
+        converter = SlateConverter(engine="string")
+        self.assertEqual(converter.slate2html(value), "<p>Hi &amp; &#233;</p>")
+        self.assertEqual(
+            converter.slate2html_many([value], processes=2, threshold=0),
+            ["<p>Hi &amp; &#233;</p>"],
+        )
+        with self.assertRaises(ValueError):
+            SlateConverter(engine="unknown")
@@ -0,0 +1,156 @@
+""" test utils module """
+# pylint: disable=import-error,no-name-in-module,too-few-public-methods,
+# pylint: disable=not-callable,no-self-use,unused-argument,invalid-name
+# -*- coding: utf-8 -*-
+import unittest
+
+from eea.volto.slate.benchmark import (LinkCollector, benchmark_link_walk,
+                                       link_heavy_value, link_urls,
+                                       transform_links, walk_by_lookup,
+                                       walk_by_type)
+from eea.volto.slate.utils import (get_node_handlers, internal_links,
+                                   iterate_nodes, node_paths, nodes_at)
+
+
+class TestIterateNodes(unittest.TestCase):
+    """TestIterateNodes."""
+
+    def test_document_order(self):
+        """test_document_order."""
+        value = [
+            {
+                "type": "p",
+                "children": [
+                    {"text": "a"},
+                    {"type": "a", "id": 1, "children": [{"text": "b"}]},
+                    {
+                        "type": "strong",
+                        "children": [
+                            {"type": "a", "id": 2, "children": []},
+                            {"text": "c"},
+                        ],
+                    },
+                ],
+            },
+            {"type": "a", "id": 3, "children": [{"text": "d"}]},
+        ]
+        self.assertEqual(
+            [node["id"] for node in iterate_nodes(value, {"a"})], [1, 2, 3]
+        )
+        self.assertEqual(
+            [node["type"] for node in iterate_nodes(value, ("p", "strong"))],
+            ["p", "strong"],
+        )
+        self.assertEqual(list(iterate_nodes(value, {})), [])
+
+    def test_text_nodes(self):
+        """Text nodes aren't yielded, whatever their marks"""
+        value = [{"text": "a", "type": "a"}, {"text": "b", "bold": True}]
+        self.assertEqual(list(iterate_nodes(value, {"a"})), [])
+
+    def test_deep_value(self):
+        """test_deep_value."""
+        value = node = [{"type": "a", "children": []}]
+        for _ in range(5000):
+            node[0]["children"] = [{"type": "li", "children": []}]
+            node = node[0]["children"]
+        self.assertEqual(len(list(iterate_nodes(value, {"li"}))), 5000)
+
+
+class TestNodePaths(unittest.TestCase):
+    """TestNodePaths."""
+
+    value = [
+        {"type": "p", "children": [{"text": "a"}]},
+        {
+            "type": "p",
+            "children": [
+                {"text": "b"},
+                {
+                    "type": "strong",
+                    "children": [{"type": "a", "id": 1, "children": []}],
+                },
+                {"type": "a", "id": 2, "children": [{"text": "c"}]},
+            ],
+        },
+    ]
+
+    def test_node_paths(self):
+        """test_node_paths."""
+        self.assertEqual(node_paths(self.value, {"a"}), [[1, 1, 0], [1, 2]])
+        self.assertEqual(node_paths(self.value, {"li"}), [])
+        self.assertEqual(node_paths([], {"a"}), [])
+
+    def test_nodes_at(self):
+        """test_nodes_at."""
+        nodes = nodes_at(self.value, node_paths(self.value, {"a"}), {"a"})
+        self.assertEqual([node["id"] for node in nodes], [1, 2])
+        self.assertEqual(nodes_at(self.value, [], {"a"}), [])
+
+    def test_stale_paths(self):
+        """Paths that don't lead to a node of the types are rejected"""
+        for paths in ([[1, 0]], [[1, 1]], [[2]], [[1, 1, 0, 0]], [[]], [None]):
+            self.assertEqual(nodes_at(self.value, paths, {"a"}), None)
+
+
+class TestNodeHandlers(unittest.TestCase):
+    """TestNodeHandlers."""
+
+    def test_handlers(self):
+        """test_handlers."""
+
+        class Collector(LinkCollector):
+            """Collector."""
+
+            def handle_p(self, child):
+                """handle_p.
+
+                :param child:
+                """
+
+        self.assertEqual(
+            get_node_handlers(LinkCollector), {"a": LinkCollector.handle_a}
+        )
+        self.assertEqual(sorted(get_node_handlers(Collector)), ["a", "p"])
+        # the table of a subclass doesn't change the one of its base class
+        self.assertEqual(list(get_node_handlers(LinkCollector)), ["a"])
+
+    def test_link_walk(self):
+        """Both walks collect all the links of a value"""
+        value = link_heavy_value(50)
+        by_lookup, by_type = LinkCollector(), LinkCollector()
+        walk_by_lookup(by_lookup, value)
+        walk_by_type(by_type, value)
+
+        self.assertEqual(len(by_type.links), 50)
+        self.assertEqual(
+            [link["@id"] for link in by_type.links],
+            ["../resolveuid/{:032x}".format(i) for i in range(50)],
+        )
+        self.assertEqual(
+            sorted(link["@id"] for link in by_lookup.links),
+            sorted(link["@id"] for link in by_type.links),
+        )
+
+    def test_internal_links(self):
+        """test_internal_links."""
+        self.assertEqual(internal_links({"type": "a"}), [])
+        self.assertEqual(
+            internal_links({"type": "a", "data": {"link": {"external": {}}}}), []
+        )
+
+    def test_benchmark(self):
+        """test_benchmark."""
+        timings = benchmark_link_walk([link_heavy_value(10)], repeat=1)
+        self.assertEqual(sorted(timings), ["lookup", "transform", "type"])
+
+    def test_transform_links(self):
+        """test_transform_links."""
+        value = link_heavy_value(3)
+        transform_links(value, link_urls([value]))
+        collector = LinkCollector()
+        walk_by_type(collector, value)
+        self.assertEqual(
+            [link["@id"] for link in collector.links],
+            ["http://nohost/plone/page-{:06x}".format(i) for i in range(3)],
+        )
@@ -0,0 +1,58 @@
+""" Upgrade to 1.1
+"""
+# pylint: disable=import-error,no-name-in-module
+import logging
+
+import transaction
+from plone import api
+from plone.restapi.behaviors import IBlocks
+
+from eea.volto.slate.block import SlateBlockDeserializerBase, index_links
+
+logger = logging.getLogger("eea.volto.slate")
+
+
+def index_block_links(obj):
+    """ Store the link paths of the slate blocks of an object, returns True
+    if it has any slate block
+    """
+    blocks = getattr(obj, "blocks", None)
+    if not isinstance(blocks, dict):
+        return False
+
+    changed = False
+    for block in blocks.values():
+        if isinstance(block, dict) and block.get("@type") == "slate":
+            index_links(block)
+            changed = True
+
+    if changed:
+        # blocks is a plain dict, store it again to persist the change
+        obj.blocks = blocks
+    return changed
+
+
+def index_slate_links(context):
+    """ Store the paths of the link nodes of the existing slate blocks, see
+    block.index_links. Nothing is stored if the link transforms are disabled,
+    as nothing would keep the paths up to date
+    """
+    if SlateBlockDeserializerBase.disabled:
+        logger.info("The slate link transforms are disabled, links not indexed")
+        return
+
+    portal = api.portal.get()
+    catalog = api.portal.get_tool("portal_catalog")
+    brains = catalog.unrestrictedSearchResults(
+        object_provides=IBlocks.__identifier__
+    )
+
+    count = int(index_block_links(portal))
+    for i, brain in enumerate(brains, 1):
+        if index_block_links(brain._unrestrictedGetObject()):
+            count += 1
+        if i % 500 == 0:
+            transaction.savepoint(optimistic=True)
+            logger.info("Indexed the slate links of %s/%s objects", i, len(brains))
+
+    logger.info("Indexed the slate links of %s objects", count)
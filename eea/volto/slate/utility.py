@@ -1,22 +1,136 @@
 """ utilities module """
 # pylint: disable=no-self-use
+import json
+from functools import partial
+from multiprocessing import cpu_count, get_context
+
+from .cache import LRUCache, digest, structural_hash
+from .config import (BATCH_PROCESSES, BATCH_START_METHOD, BATCH_THRESHOLD,
+                     CONVERSION_CACHE_SIZE, HTML_PARSER, SLATE2HTML_ENGINE,
+                     VERSION)
 from .html2slate import text_to_slate
-from .slate2html import slate_to_html
+from .interfaces import ConversionError
+from .slate2html import get_engine, slate_to_html
+from .utils import json_loads
+
+
+def convert_item(args):
+    """Convert one item of a batch, returns a ConversionError on failure
+
+    :param args: a (converter function, item) tuple
+    """
+    convert, item = args
+    try:
+        return convert(item)
+    except Exception as e:  # pylint: disable=broad-except
+        # the original exception may not survive pickling between processes
+        return ConversionError("{}: {}".format(type(e).__name__, e))
+
+
+def convert_many(convert, items, processes=None, threshold=None):
+    """Convert a sequence of items, returning the results in the same order
+
+    :param convert: the converter function, needs to be picklable
+    :param items:
+    :param processes: size of the process pool, see config.BATCH_PROCESSES
+    :param threshold: minimum batch size to use a process pool, see
+        config.BATCH_THRESHOLD
+    """
+    processes = processes or BATCH_PROCESSES or cpu_count()
+    if threshold is None:
+        threshold = BATCH_THRESHOLD
+
+    jobs = [(convert, item) for item in items]
+    if len(jobs) < threshold or processes == 1:
+        return [convert_item(job) for job in jobs]
+
+    pool = get_context(BATCH_START_METHOD).Pool(processes)
+    try:
+        chunksize = max(1, len(jobs) // (processes * 4))
+        return pool.map(convert_item, jobs, chunksize)
+    finally:
+        pool.close()
+        pool.join()
 
 
 class SlateConverter(object):
-    """SlateConverter."""
+    """SlateConverter.
+
+    Conversion results are kept in an LRU cache, keyed by a digest of the
+    input and the package version. Cached slate values are stored as JSON, so
+    each caller gets its own copy. The HTML of slate values is cached for each
+    top-level node, so an edited value only has its changed nodes serialized
+    again.
+
+    :param cache_size: size in bytes of the cache, see
+        config.CONVERSION_CACHE_SIZE
+    :param engine: the slate2html engine, see config.SLATE2HTML_ENGINE
+    """
+
+    def __init__(self, cache_size=CONVERSION_CACHE_SIZE, engine=SLATE2HTML_ENGINE):
+        self.cache = LRUCache(cache_size) if cache_size else None
+        get_engine(engine)  # fail early on unknown engines
+        self.to_html = partial(slate_to_html, engine=engine)
 
     def html2slate(self, text):
         """html2slate.
 
         :param text:
         """
-        return text_to_slate(text)
+        if self.cache is None:
+            return text_to_slate(text)
+
+        # bytes are decoded with their detected encoding, which may not be
+        # UTF-8, so they don't share the keys of strings. The parser backends
+        # fix broken markup differently
+        kind = "html2slate" if isinstance(text, str) else "html2slate-bytes"
+        key = digest(kind, VERSION, HTML_PARSER, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return json_loads(cached)
+
+        value = text_to_slate(text)
+        self.cache.set(key, json.dumps(value))
+        return value
 
     def slate2html(self, value):
         """slate2html.
 
         :param value:
         """
-        return slate_to_html(value)
+        if self.cache is None:
+            return self.to_html(value)
+
+        res = []
+        for node in value:
+            try:
+                key = digest("slate2html", VERSION, structural_hash(node))
+            except ValueError:
+                # marshal only takes builtin types, nested up to 2000 levels.
+                # Other nodes, like OrderedDicts, aren't cached
+                res.append(self.to_html([node]))
+                continue
+            html = self.cache.get(key)
+            if html is None:
+                html = self.to_html([node])
+                self.cache.set(key, html)
+            res.append(html)
+        return u"".join(res)
+
+    def html2slate_many(self, texts, processes=None, threshold=None):
+        """html2slate_many.
+
+        :param texts:
+        :param processes:
+        :param threshold:
+        """
+        return convert_many(text_to_slate, texts, processes, threshold)
+
+    def slate2html_many(self, values, processes=None, threshold=None):
+        """slate2html_many.
+
+        :param values:
+        :param processes:
+        :param threshold:
+        """
+        return convert_many(self.to_html, values, processes, threshold)
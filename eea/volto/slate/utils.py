@@ -1,6 +1,30 @@
 """ utils module """
+import json
+import marshal
+import re
 from collections import deque
 
+from .cache import LRUCache, canonical_json
+from .config import KNOWN_BLOCK_TYPES, SLATE_DATA_CACHE_SIZE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TAG_HANDLER_PREFIX = "handle_tag_"
+NODE_HANDLER_PREFIX = "handle_"
+
+# the resolveuid links recognized by plone.restapi's uid_to_url
+RESOLVEUID_RE = re.compile("^[./]*resolve[Uu]id/([^/]*)/?(.*)$")
+
+# orjson parses integers that don't fit in 64 bits as floats
+LONG_NUMBER = re.compile(r"\d{19}")
+
+# data-slate-data JSON by marshaled payload, marshaled payload by JSON
+SLATE_DATA_JSON = LRUCache(SLATE_DATA_CACHE_SIZE)
+SLATE_DATA_VALUES = LRUCache(SLATE_DATA_CACHE_SIZE)
+
 
 def iterate_children(value):
     """iterate_children.
@@ -13,3 +37,197 @@ def iterate_children(value):
         yield child
         if child.get("children"):
             queue.extend(child["children"] or [])
+
+
+def iterate_nodes(value, types):
+    """Yields the element nodes of a slate value that have one of the given
+    types, in document order. Text nodes are skipped with a single lookup.
+
+    :param value: a list of slate nodes
+    :param types: a container of node types, like a dict of handlers
+    """
+    stack = [iter(value)]
+    while stack:
+        for child in stack[-1]:
+            children = child.get("children")
+            if children is None:  # a text node
+                continue
+            if child.get("type") in types:
+                yield child
+            if children:
+                stack.append(iter(children))
+                break
+        else:
+            stack.pop()
+
+
+def node_paths(value, types):
+    """Returns the paths of the element nodes of a slate value that have one
+    of the given types, in document order. A path is the list of the child
+    positions from the top-level nodes, like [0, 2, 1].
+
+    :param value: a list of slate nodes
+    :param types: a container of node types
+    """
+    paths = []
+    stack = [(iter(enumerate(value)), [])]
+    while stack:
+        children, parent_path = stack[-1]
+        for i, child in children:
+            grandchildren = child.get("children")
+            if grandchildren is None:  # a text node
+                continue
+            path = parent_path + [i]
+            if child.get("type") in types:
+                paths.append(path)
+            if grandchildren:
+                stack.append((iter(enumerate(grandchildren)), path))
+                break
+        else:
+            stack.pop()
+    return paths
+
+
+def nodes_at(value, paths, types):
+    """Returns the nodes of a slate value at the given paths, see node_paths,
+    or None if a path doesn't lead to an element node of one of the types
+
+    :param value: a list of slate nodes
+    :param paths:
+    :param types: a container of node types
+    """
+    nodes = []
+    for path in paths:
+        node = {"children": value}
+        try:
+            for i in path:
+                node = node["children"][i]
+        except (IndexError, KeyError, TypeError):
+            return None
+        if not path or not isinstance(node, dict) or node.get("type") not in types:
+            return None
+        nodes.append(node)
+    return nodes
+
+
+def internal_links(node):
+    """Returns the internal links of a slate link node, the dicts with the
+    ``@id`` of the link targets
+
+    :param node:
+    """
+    data = node.get("data", {})
+    return data.get("link", {}).get("internal", {}).get("internal_link") or []
+
+
+def resolved_url(path, urls, targets=None):
+    """Returns the URL of a resolveuid link, like plone.restapi's uid_to_url,
+    with the URLs of the UIDs already looked up
+
+    :param path:
+    :param urls: a {uid: url} mapping of the content URLs
+    :param targets: a {uid: url} mapping of the primary field targets of the
+        links without suffix, see block.primary_field_target
+    """
+    if not path:
+        return ""
+    match = RESOLVEUID_RE.match(path)
+    if match is None:
+        return path
+    uid, suffix = match.groups()
+    href = urls.get(uid)
+    if href is None:
+        return path
+    if suffix:
+        href += "/" + suffix
+    elif targets and uid in targets:
+        href = targets[uid]
+    return href
+
+
+def get_node_handlers(cls):
+    """Returns the {node type: function} dispatch table of a slate block
+    transformer class, from its ``handle_<type>`` methods. It is computed
+    once per class and stored on it, call it with the instance type.
+
+    :param cls:
+    """
+    handlers = cls.__dict__.get("_node_handlers")
+    if handlers is None:
+        handlers = {}
+        for name in dir(cls):
+            if name.startswith(NODE_HANDLER_PREFIX) and callable(getattr(cls, name)):
+                handlers[name[len(NODE_HANDLER_PREFIX) :]] = getattr(cls, name)
+        cls._node_handlers = handlers
+    return handlers
+
+
+def get_tag_handlers(cls):
+    """Returns the {tagname: function} dispatch table of a converter class.
+
+    The table maps each ``handle_tag_<tagname>`` method, including the ones
+    added by subclasses, to its tag name. Known block types without a
+    dedicated method are dispatched to ``handle_block``. It is computed once
+    per class and stored on it, call it with the instance type.
+
+    :param cls:
+    """
+    handlers = cls.__dict__.get("_tag_handlers")
+    if handlers is None:
+        handlers = dict((tagname, cls.handle_block) for tagname in KNOWN_BLOCK_TYPES)
+        for name in dir(cls):
+            if name.startswith(TAG_HANDLER_PREFIX):
+                handlers[name[len(TAG_HANDLER_PREFIX) :]] = getattr(cls, name)
+        cls._tag_handlers = handlers
+    return handlers
+
+
+def json_loads(text):
+    """Parse JSON, with orjson if it's installed.
+
+    Only decoding uses orjson: its encoder output isn't the canonical JSON
+    (no \\u escapes, different float exponents). JSON that orjson rejects,
+    like NaN, or with numbers that may not fit in 64 bits (orjson turns
+    them into floats) is parsed by the json module.
+
+    :param text:
+    """
+    if orjson is not None and not LONG_NUMBER.search(text):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def encode_slate_data(value):
+    """Returns the canonical JSON of a data-slate-data payload. Repeated
+    payloads, like footnotes, are encoded only once.
+
+    :param value:
+    """
+    try:
+        key = marshal.dumps(value, 0)
+    except ValueError:  # not a JSON value
+        return canonical_json(value)
+
+    text = SLATE_DATA_JSON.get(key)
+    if text is None:
+        text = canonical_json(value)
+        SLATE_DATA_JSON.set(key, text)
+    return text
+
+
+def decode_slate_data(text):
+    """Returns the payload of a data-slate-data attribute. Repeated payloads
+    are parsed only once, each call gets its own copy of the payload.
+
+    :param text:
+    """
+    cached = SLATE_DATA_VALUES.get(text)
+    if cached is not None:
+        return marshal.loads(cached)
+
+    value = json_loads(text)
+    SLATE_DATA_VALUES.set(text, marshal.dumps(value))
+    return value